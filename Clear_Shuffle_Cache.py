@@ -0,0 +1,157 @@
+import time
+import logging
+import argparse
+import requests
+import urllib3
+from datetime import datetime, timedelta, timezone
+
+# Disable SSL warnings (the OpenSearch node uses a self-signed certificate)
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# OpenSearch creds & endpoint
+OS_HOST = 'https://localhost:9200'
+OS_USER = 'myuser'
+OS_PASS = 'yourpassword'
+
+# Index (or rollover alias) to clean and the field holding the execution start time (epoch seconds)
+INDEX = 'workflowexecution'
+TIME_FIELD = 'started_at'
+
+# Keep executions newer than this many days
+RETENTION_DAYS = 7
+
+# Throttling of the delete: documents per second across all slices, and batch size
+REQUESTS_PER_SECOND = 500
+SCROLL_SIZE = 1000
+POLL_INTERVAL = 10  # seconds between task status checks
+
+LOG_FILE = '/var/log/clear_index.log'
+
+# Setup logging
+handlers = [logging.StreamHandler()]
+try:
+    handlers.append(logging.FileHandler(LOG_FILE))
+except OSError:
+    pass
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=handlers)
+
+
+class OpenSearch:
+    """Minimal OpenSearch REST client on a keep-alive session."""
+
+    def __init__(self, host=OS_HOST, user=OS_USER, password=OS_PASS, verify=False):
+        self.host = host.rstrip('/')
+        self.session = requests.Session()
+        self.session.auth = (user, password)
+        self.session.verify = verify
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, f'{self.host}/{path.lstrip("/")}', timeout=60, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+
+# Function to start an async, sliced and throttled delete of the executions older than the cutoff
+def start_purge(client, index, cutoff, time_field=TIME_FIELD, requests_per_second=REQUESTS_PER_SECOND, slices='auto'):
+    query = {'query': {'range': {time_field: {'lt': int(cutoff.timestamp())}}}}
+    params = {
+        'conflicts': 'proceed',
+        'slices': slices,
+        'requests_per_second': requests_per_second,
+        'scroll_size': SCROLL_SIZE,
+        'wait_for_completion': 'false',
+    }
+    result = client.request('POST', f'{index}/_delete_by_query', params=params, json=query)
+    return result['task']
+
+
+# Function to poll a task until it completes, logging its progress
+def wait_for_task(client, task_id, poll_interval=POLL_INTERVAL):
+    while True:
+        result = client.request('GET', f'_tasks/{task_id}')
+        status = result.get('task', {}).get('status', {})
+        logging.info(f"Task {task_id}: deleted {status.get('deleted', 0)}/{status.get('total', 0)} "
+                     f"({status.get('batches', 0)} batches, {status.get('version_conflicts', 0)} conflicts)")
+        if result.get('completed'):
+            response = result.get('response', status)
+            if result.get('error') or response.get('failures'):
+                logging.error(f"Task {task_id} finished with errors: {result.get('error') or response.get('failures')}")
+            return response
+        time.sleep(poll_interval)
+
+
+# Function to get the newest execution start time of an index (None when it holds no executions)
+def newest_execution(client, index, time_field=TIME_FIELD):
+    result = client.request('POST', f'{index}/_search', json={'size': 0, 'aggs': {'newest': {'max': {'field': time_field}}}})
+    value = result.get('aggregations', {}).get('newest', {}).get('value')
+    return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+
+
+# Function to roll the alias over and drop the indices whose newest execution is older than the retention.
+# The creation date of an index is not enough: a retired index holds executions up to its rollover.
+def rollover_and_drop(client, alias, retention, now=None, time_field=TIME_FIELD):
+    now = now or datetime.now(timezone.utc)
+    try:
+        aliases = client.request('GET', f'_alias/{alias}')
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            logging.error(f"{alias} is a plain index, not a rollover alias: run without --rollover, or reindex it "
+                          f"behind an alias (e.g. {alias}-000001 with alias {alias}) first")
+            return []
+        raise
+
+    result = client.request('POST', f'{alias}/_rollover', json={'conditions': {'max_age': f'{int(retention.total_seconds() // 3600)}h'}})
+    if result.get('rolled_over'):
+        logging.info(f"Rolled {alias} over from {result['old_index']} to {result['new_index']}")
+        aliases = client.request('GET', f'_alias/{alias}')
+
+    write_indices = {name for name, info in aliases.items()
+                     if info.get('aliases', {}).get(alias, {}).get('is_write_index', True)}
+    indices = client.request('GET', f'_cat/indices/{alias}-*', params={'format': 'json', 'h': 'index,creation.date'})
+    dropped = []
+    for index in indices:
+        created = datetime.fromtimestamp(int(index['creation.date']) / 1000, timezone.utc)
+        if index['index'] in write_indices or now - created < retention:
+            continue
+        newest = newest_execution(client, index['index'], time_field)
+        if newest and now - newest < retention:
+            logging.info(f"Keeping index {index['index']}: it holds executions up to {newest:%Y-%m-%d %H:%M}")
+            continue
+        client.request('DELETE', index['index'])
+        logging.info(f"Dropped index {index['index']} (newest execution {newest:%Y-%m-%d %H:%M})" if newest
+                     else f"Dropped empty index {index['index']}")
+        dropped.append(index['index'])
+    return dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete Shuffle workflow executions older than the retention.')
+    parser.add_argument('--host', default=OS_HOST, help='OpenSearch endpoint')
+    parser.add_argument('--index', default=INDEX, help='Index or rollover alias to clean')
+    parser.add_argument('--retention-days', type=float, default=RETENTION_DAYS, help='Keep executions newer than this')
+    parser.add_argument('--requests-per-second', type=float, default=REQUESTS_PER_SECOND, help='Delete throttle')
+    parser.add_argument('--slices', default='auto', help='Number of slices for the delete (default: auto)')
+    parser.add_argument('--rollover', action='store_true', help='Roll the alias over and drop old indices instead of deleting documents')
+    parser.add_argument('--no-wait', action='store_true', help='Start the delete task and exit without polling it')
+    args = parser.parse_args()
+
+    client = OpenSearch(host=args.host)
+    retention = timedelta(days=args.retention_days)
+
+    if args.rollover:
+        dropped = rollover_and_drop(client, args.index, retention)
+        logging.info(f"Dropped {len(dropped)} indices behind {args.index}")
+        return
+
+    cutoff = datetime.now(timezone.utc) - retention
+    task_id = start_purge(client, args.index, cutoff, requests_per_second=args.requests_per_second, slices=args.slices)
+    logging.info(f"Started purge of {args.index} executions before {cutoff:%Y-%m-%d %H:%M:%S} UTC (task {task_id})")
+    if args.no_wait:
+        return
+    response = wait_for_task(client, task_id)
+    logging.info(f"Cleared {response.get('deleted', 0)} executions from {args.index}")
+
+
+if __name__ == '__main__':
+    main()
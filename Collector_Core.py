@@ -0,0 +1,489 @@
+import os
+import json
+import fcntl
+import time
+import socket
+import asyncio
+import logging
+import argparse
+from collections import deque
+from itertools import islice
+from urllib.parse import urljoin
+from datetime import datetime, timedelta, timezone
+import aiohttp
+from Field_Projection import STATS as PROJECTION_STATS
+import Collector_Profiler as profiler
+from Collector_Profiler import span
+from Load_Shedding import SEND_RATE, LoadShedder
+from GeoIP_Enrichment import GEOIP_ENV, get_enricher
+from Event_Archive import ARCHIVE_ENV, get_archive
+
+# Graylog UDP host and port
+GRAYLOG_HOST = '127.0.0.1'
+GRAYLOG_PORT = 12201
+
+# Concurrency limits: tenant fetches in flight, connections overall and per vendor host
+MAX_CONCURRENCY = 200
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 20
+KEEPALIVE_TIMEOUT = 60  # seconds an idle connection is kept open for reuse
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3  # retries of a throttled (429) or failed (5xx) request
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Backfill defaults: sub-window size and windows fetched ahead of the one being sent, per tenant
+BACKFILL_STEP = timedelta(minutes=15)
+BACKFILL_LOOKAHEAD = 8
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body, url):
+        super().__init__(f"HTTP {status} from {url}: {str(body)[:200]}")
+        self.status = status
+        self.body = body
+
+
+class Response:
+    def __init__(self, status, headers, links, data):
+        self.status = status
+        self.headers = headers
+        self.links = links
+        self.data = data
+
+
+# Function to get the wait before retrying: the Retry-After seconds when usable, else exponential backoff
+def retry_delay(headers, retries):
+    try:
+        return min(float(headers.get('Retry-After')), 300)
+    except (TypeError, ValueError):
+        return 2 ** retries
+
+
+class RateLimiter:
+    """Token bucket shared by every request made with the same credentials."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncHTTPClient:
+    """Shared aiohttp session: one connection pool with keep-alive connections per vendor host."""
+
+    def __init__(self, limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST, timeout=REQUEST_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.session = None
+        self.limiters = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, method, url, params=None, headers=None, data=None, auth=None, keep_auth_on_redirect=False, rate=None):
+        if auth is not None:
+            auth = aiohttp.BasicAuth(*auth)
+        limiter = None
+        if rate:
+            key, requests_per_second = rate
+            limiter = self.limiters.setdefault(key, RateLimiter(requests_per_second))
+        retries = 0
+        for _ in range(5 + MAX_RETRIES):
+            if limiter:
+                with span('rate_limit_wait'):
+                    await limiter.acquire()
+            with span('http', method=method, url=url):
+                async with self.session.request(method, url, params=params, headers=headers, data=data, auth=auth,
+                                                allow_redirects=not keep_auth_on_redirect) as response:
+                    # Follow redirects ourselves when the Authorization header must be preserved (Meraki)
+                    if keep_auth_on_redirect and response.status in (301, 302, 303, 307, 308):
+                        url = urljoin(str(response.url), response.headers['Location'])
+                        params = None
+                        continue
+                    if (response.status == 429 or response.status in RETRY_STATUSES) and retries < MAX_RETRIES:
+                        retries += 1
+                        logging.warning(f"HTTP {response.status} from {url}, retry {retries}/{MAX_RETRIES}")
+                        await asyncio.sleep(retry_delay(response.headers, retries))
+                        continue
+                    body = await response.read()
+                    try:
+                        payload = json.loads(body) if body else None
+                    except ValueError:
+                        payload = body.decode('utf-8', 'replace')
+                    if response.status >= 400:
+                        raise HTTPError(response.status, payload, url)
+                    links = {rel: {'url': str(link['url'])} for rel, link in response.links.items()}
+                    return Response(response.status, response.headers, links, payload)
+        raise HTTPError(310, 'Too many redirects', url)
+
+
+class Source:
+    """Adapter for one tenant of a vendor API: auth, paginate and transform."""
+
+    tool = None
+    window = timedelta(minutes=5)  # look-back of a scheduled run
+    rate_limit = None  # vendor limit in requests per second for one set of credentials
+    split_backfill = True  # False when the API cannot bound a query by its end time (see backfill_async)
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.org = credentials.get('ORG')
+
+    @property
+    def key(self):
+        return f'{self.tool}:{self.org}'
+
+    @property
+    def rate(self):
+        return (self.key, self.rate_limit) if self.rate_limit else None
+
+    def event_time(self, event):
+        """Sort key used to send backfilled events in time order."""
+        return event.get('timestamp') or 0
+
+    def default_range(self, now=None):
+        end = now or datetime.now(timezone.utc)
+        return end - self.window, end
+
+    async def auth(self, client):
+        """Authenticate against the vendor API (store tokens/headers on self)."""
+
+    async def discover(self, client):
+        """Return the tenants reachable with these credentials (a key may span several orgs)."""
+        return [self]
+
+    async def paginate(self, client, start, end):
+        """Async generator of (org_name, records) pages for the [start, end) range."""
+        raise NotImplementedError
+        yield
+
+    def transform(self, org_name, records):
+        """Turn the raw records of one org into the events sent to Graylog."""
+        return records
+
+
+# Function to send logs to Graylog using UDP
+def send_to_graylog(logs):
+    sent = 0
+    try:
+        with span('json_dumps', events=len(logs)):
+            messages = [json.dumps(log).encode() for log in logs]
+        with span('udp_send', events=len(messages)), socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for message in messages:
+                sock.sendto(message, (GRAYLOG_HOST, GRAYLOG_PORT))
+                sent += 1
+    except Exception as e:
+        logging.error(f"Error sending logs to Graylog: {e}")
+    return sent
+
+
+# Function to run the pipeline stages (enrichment, correlation, ...) on every batch before sending it.
+# A stage is a callable taking the events of one batch and returning the events to send.
+def run_stages(stages, events):
+    for stage in stages:
+        with span('stage', stage=type(stage).__name__, events=len(events)):
+            events = stage(events)
+    return events
+
+
+def staged_sender(stages, sender=send_to_graylog):
+    if not stages:
+        return sender
+
+    def send(events):
+        events = run_stages(stages, events)
+        return sender(events) if events else 0
+
+    return send
+
+
+# Function to fetch and transform the events of one tenant, one result per org.
+# With keep_partial, a page that fails stops the pagination but the pages already fetched are still sent;
+# backfills pass keep_partial=False so the window is not checkpointed and is fetched again on resume.
+# The archive receives the raw records as returned by the API, before transform.
+async def collect(source, client, start, end, keep_partial=True, archive=None):
+    batches = {}
+    try:
+        async for org_name, records in source.paginate(client, start, end):
+            batches.setdefault(org_name, []).extend(records)
+    except Exception as e:
+        if not keep_partial or not batches:
+            raise
+        logging.error(f"Error fetching {source.tool} events for {source.org}, sending the pages already fetched: {e}")
+    if archive:
+        with span('archive', tool=source.tool, org=source.org):
+            for org_name, records in batches.items():
+                archive(source.tool, org_name, records)
+    results = []
+    for org_name, records in batches.items():
+        with span('transform', tool=source.tool, org=org_name, records=len(records)):
+            results.append((org_name, len(records), source.transform(org_name, records)))
+    return results
+
+
+async def authenticate(source, client):
+    try:
+        with span('auth', tool=source.tool, org=source.org):
+            await source.auth(client)
+            return await source.discover(client)
+    except Exception as e:
+        logging.error(f"Error authenticating {source.tool} for {source.org}: {e}")
+        return []
+
+
+async def iter_results(sources, client, start=None, end=None, concurrency=MAX_CONCURRENCY, archive=None):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_tenant(source):
+        async with semaphore:
+            logging.info(f"Fetching events from {source.org}...")
+            window = (start, end) if start else source.default_range()
+            try:
+                return await collect(source, client, *window, archive=archive)
+            except Exception as e:
+                logging.error(f"Error fetching {source.tool} events for {source.org}: {e}")
+                return []
+
+    async def run_source(source):
+        async with semaphore:
+            tenants = await authenticate(source, client)
+        results = await asyncio.gather(*(run_tenant(tenant) for tenant in tenants))
+        return [result for tenant_results in results for result in tenant_results]
+
+    for future in asyncio.as_completed([run_source(source) for source in sources]):
+        for result in await future:
+            yield result
+
+
+# Function to fetch every source concurrently and send each org's events as soon as they are ready
+# With a shedder, events go through its priority queue instead of being sent as they arrive. The stages run
+# before the queue, so every event reaches them and the events they add (CORR) are prioritized too.
+# The archive receives the raw records of every page, so shed events are archived too.
+async def run_sources_async(sources, start=None, end=None, concurrency=MAX_CONCURRENCY, sender=send_to_graylog,
+                            shedder=None, archive=None, stages=()):
+    total_fetched = 0
+    total_sent = 0
+    async with AsyncHTTPClient() as client:
+        drain_task = asyncio.ensure_future(shedder.drain(sender)) if shedder else None
+        async for org_name, fetched, events in iter_results(sources, client, start, end, concurrency, archive):
+            total_fetched += fetched
+            if events and stages:
+                events = run_stages(stages, events)
+            if events and shedder:
+                logging.info(f"Queueing {len(events)} events from {org_name} for Graylog...")
+                shedder.push(events)
+            elif events:
+                logging.info(f"Sending {len(events)} events from {org_name} to Graylog...")
+                total_sent += sender(events)
+        if shedder:
+            total_sent = await shedder.close(drain_task, sender)
+
+    logging.info(f"Total events fetched: {total_fetched}")
+    logging.info(f"Total events sent: {total_sent}")
+    PROJECTION_STATS.report()
+    return total_fetched, total_sent
+
+
+def run_sources(sources, **kwargs):
+    return asyncio.run(run_sources_async(sources, **kwargs))
+
+
+# Function to fetch every source without sending, returning [(org_name, events)]
+def fetch_sources(sources, start=None, end=None, concurrency=MAX_CONCURRENCY):
+    async def fetch():
+        async with AsyncHTTPClient() as client:
+            return [(org_name, events) async for org_name, _, events in iter_results(sources, client, start, end, concurrency)]
+
+    return asyncio.run(fetch())
+
+
+def to_millis(dt):
+    return int(dt.timestamp() * 1000)
+
+
+# Function to split [start, end) into consecutive sub-windows
+def split_range(start, end, step=BACKFILL_STEP):
+    windows = []
+    while start < end:
+        windows.append((start, min(start + step, end)))
+        start += step
+    return windows
+
+
+class Checkpoint:
+    """Last backfilled window end per tenant, persisted after every window so a backfill can resume.
+    Sharded workers share the file: every update is merged into it under an exclusive lock."""
+
+    def __init__(self, path, start, end):
+        self.path = path
+        self.range = [start.isoformat(), end.isoformat()]
+        self.tenants = self.load() if path else {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding='utf-8') as f:
+            content = f.read()
+        saved = json.loads(content) if content.strip() else {}
+        return saved.get('tenants', {}) if saved.get('range') == self.range else {}
+
+    def resume_from(self, key):
+        done = self.tenants.get(key)
+        return datetime.fromisoformat(done) if done else None
+
+    def mark(self, key, end):
+        self.tenants[key] = end.isoformat()
+        if not self.path:
+            return
+        with open(f'{self.path}.lock', 'a', encoding='utf-8') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Keep the tenants written by the other workers since this one loaded the file
+                self.tenants = {**self.load(), **self.tenants}
+                tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'range': self.range, 'tenants': self.tenants}, f)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# Function to backfill one tenant: windows are fetched ahead in parallel but sent in time order
+async def backfill_tenant(source, client, windows, semaphore, checkpoint, sender, lookahead=BACKFILL_LOOKAHEAD,
+                          archive=None):
+    async def fetch(window):
+        async with semaphore:
+            return await collect(source, client, *window, keep_partial=False, archive=archive)
+
+    windows = iter(windows)
+    pending = deque()
+
+    def schedule():
+        for window in islice(windows, lookahead - len(pending)):
+            pending.append((window, asyncio.ensure_future(fetch(window))))
+
+    fetched = sent = covered = 0
+    schedule()
+    try:
+        while pending:
+            window, task = pending.popleft()
+            for org_name, count, events in await task:
+                events.sort(key=source.event_time)
+                fetched += count
+                if events:
+                    sent += sender(events)
+            checkpoint.mark(source.key, window[1])
+            covered += (window[1] - window[0]).total_seconds()
+            logging.info(f"Backfilled {source.key} {window[0]:%Y-%m-%d %H:%M} - {window[1]:%H:%M}")
+            schedule()
+    except Exception as e:
+        logging.error(f"Backfill of {source.key} stopped at {window[0]:%Y-%m-%d %H:%M}, run it again to resume: {e}")
+        for _, task in pending:
+            task.cancel()
+    return fetched, sent, covered
+
+
+# Function to re-collect [start, end) for every source, split into sub-windows fetched in parallel
+async def backfill_async(sources, start, end, step=BACKFILL_STEP, checkpoint_path=None,
+                         concurrency=MAX_CONCURRENCY, sender=send_to_graylog, archive=None):
+    checkpoint = Checkpoint(checkpoint_path, start, end)
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.monotonic()
+
+    async with AsyncHTTPClient() as client:
+        tenants = [tenant for tenants in await asyncio.gather(*(authenticate(source, client) for source in sources))
+                   for tenant in tenants]
+        jobs = []
+        for tenant in tenants:
+            tenant_start = max(start, checkpoint.resume_from(tenant.key) or start)
+            if tenant_start >= end:
+                logging.info(f"Backfill of {tenant.key} already completed")
+                continue
+            # Without an end filter every sub-window would page up to now, so such APIs get the range in one window
+            windows = split_range(tenant_start, end, step) if tenant.split_backfill else [(tenant_start, end)]
+            jobs.append(backfill_tenant(tenant, client, windows, semaphore, checkpoint, sender, archive=archive))
+        results = await asyncio.gather(*jobs)
+
+    total_fetched = sum(result[0] for result in results)
+    total_sent = sum(result[1] for result in results)
+    hours = sum(result[2] for result in results) / 3600
+    minutes = (time.monotonic() - started) / 60
+    logging.info(f"Total events fetched: {total_fetched}")
+    logging.info(f"Total events sent: {total_sent}")
+    logging.info(f"Recovered {hours:.1f} hours of data over {len(jobs)} tenants in {minutes:.2f} minutes "
+                 f"({hours / max(minutes, 1e-6):.1f} hours of data per minute)")
+    PROJECTION_STATS.report()
+    return total_fetched, total_sent
+
+
+def run_backfill(sources, start, end, **kwargs):
+    return asyncio.run(backfill_async(sources, start, end, **kwargs))
+
+
+# Function to parse an ISO 8601 time as UTC (naive times are UTC, offsets are converted)
+def parse_time(value):
+    dt = datetime.fromisoformat(value)
+    return dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+# Common command line of the collector scripts
+def build_parser(tool):
+    parser = argparse.ArgumentParser(description=f'Send {tool} events to Graylog.')
+    parser.add_argument('--backfill', nargs=2, metavar=('FROM', 'TO'), type=parse_time,
+                        help='Re-collect an ISO 8601 time range (naive times are UTC) instead of the last minutes')
+    parser.add_argument('--step', type=int, default=int(BACKFILL_STEP.total_seconds() // 60),
+                        help='Backfill sub-window size in minutes')
+    parser.add_argument('--checkpoint', help='Backfill progress file (default: backfill_<tool>.json)')
+    parser.add_argument('--shed-budget', type=int, metavar='EVENTS',
+                        help='Queue events by priority and shed the lowest ones beyond this many waiting events')
+    parser.add_argument('--send-rate', type=float, default=SEND_RATE, help='Events per second sent while shedding')
+    parser.add_argument('--geoip', action='append', metavar='DB',
+                        help=f'Add country/ASN fields from an MMDB or CSV database (repeatable); also ${GEOIP_ENV}')
+    parser.add_argument('--archive', metavar='DIR', default=os.environ.get(ARCHIVE_ENV),
+                        help=f'Also archive the raw vendor records locally (see Event_Archive.py); also ${ARCHIVE_ENV}')
+    parser.add_argument('--profile', nargs='?', const='spans', metavar='MODES',
+                        help='Profile the run (optionally "cprofile,tracemalloc"); also enabled by SOC_PROFILE')
+    return parser
+
+
+# Entry point of the collector scripts: scheduled run or backfill
+def run_collector(tool, sources, argv=None, stages=()):
+    args = build_parser(tool).parse_args(argv)
+    # IP enrichment runs first so later stages (correlation) see the enriched events
+    enricher = get_enricher(args.geoip)
+    stages = ([enricher] if enricher else []) + list(stages)
+    archive = get_archive(args.archive)
+    profiler.start(args.profile)
+    try:
+        if args.backfill:
+            start, end = args.backfill
+            checkpoint = args.checkpoint or f'backfill_{tool}.json'
+            return run_backfill(sources, start, end, step=timedelta(minutes=args.step), checkpoint_path=checkpoint,
+                                sender=staged_sender(stages), archive=archive)
+        # Backfills are recovery runs and never shed events
+        shedder = LoadShedder(args.shed_budget, args.send_rate) if args.shed_budget else None
+        return run_sources(sources, shedder=shedder, archive=archive, stages=stages)
+    finally:
+        if archive:
+            archive.close()
+        if enricher:
+            enricher.close()
+        profiler.stop(tool)
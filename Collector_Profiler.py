@@ -0,0 +1,169 @@
+import io
+import os
+import json
+import time
+import pstats
+import asyncio
+import logging
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+# Opt-in profiling of the collector runs, enabled with --profile or the SOC_PROFILE variable:
+#   SOC_PROFILE=1                       timing spans per pipeline stage
+#   SOC_PROFILE=cprofile,tracemalloc    spans plus a cProfile and/or tracemalloc snapshot
+# Every run writes a Chrome trace (chrome://tracing, Perfetto) and a top-N summary to SOC_PROFILE_DIR.
+PROFILE_ENV = 'SOC_PROFILE'
+PROFILE_DIR = os.environ.get('SOC_PROFILE_DIR', 'profiles')
+TOP_N = 15
+MAX_TRACE_EVENTS = 200000  # beyond this only the per-stage totals are kept
+
+
+class NullSpan:
+    """Span returned while profiling is off: entering and leaving it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'args', 'start')
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class Trace:
+    """Spans of one run, as Chrome trace events plus totals per stage."""
+
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.events = []
+        self.totals = {}  # name -> [count, total ns, max ns]
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def thread_id(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        name = task.get_name() if task else threading.current_thread().name
+        if name not in self.threads:
+            self.threads[name] = len(self.threads) + 1
+        return self.threads[name]
+
+    def add(self, name, start, end, args):
+        duration = end - start
+        with self.lock:
+            totals = self.totals.setdefault(name, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] = max(totals[2], duration)
+            if len(self.events) < MAX_TRACE_EVENTS:
+                event = {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': self.thread_id(),
+                         'ts': (start - self.origin) / 1000, 'dur': duration / 1000}
+                if args:
+                    event['args'] = args
+                self.events.append(event)
+
+    def chrome_trace(self):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for name, tid in self.threads.items()]
+        return {'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}
+
+    def summary(self, top_n=TOP_N):
+        lines = [f"{'stage':<24}{'calls':>10}{'total ms':>12}{'avg us':>12}{'max ms':>10}"]
+        ranked = sorted(self.totals.items(), key=lambda item: item[1][1], reverse=True)[:top_n]
+        for name, (count, total, longest) in ranked:
+            lines.append(f"{name:<24}{count:>10}{total / 1e6:>12.1f}{total / count / 1e3:>12.1f}{longest / 1e6:>10.1f}")
+        return '\n'.join(lines)
+
+
+class Profiler:
+    def __init__(self):
+        self.trace = None
+        self.modes = set()
+        self.profile = None
+        self.memory_start = None
+
+    @property
+    def enabled(self):
+        return self.trace is not None
+
+    def start(self, modes):
+        self.modes = {mode.strip() for mode in str(modes).split(',') if mode.strip()}
+        self.trace = Trace()
+        if 'tracemalloc' in self.modes:
+            tracemalloc.start(10)
+            self.memory_start = tracemalloc.take_snapshot()
+        if 'cprofile' in self.modes:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self, label):
+        if not self.enabled:
+            return None
+        if self.profile:
+            self.profile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{label}-{datetime.now():%Y%m%d-%H%M%S}")
+
+        with open(f'{base}.trace.json', 'w', encoding='utf-8') as f:
+            json.dump(self.trace.chrome_trace(), f)
+        report = [f"Run {label}: {sum(count for count, _, _ in self.trace.totals.values())} spans", self.trace.summary()]
+
+        if self.profile:
+            self.profile.dump_stats(f'{base}.prof')
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(TOP_N)
+            report += ['', 'cProfile (cumulative):', stream.getvalue()]
+        if self.memory_start:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            report += ['', 'tracemalloc (allocated during the run):']
+            report += [str(stat) for stat in snapshot.compare_to(self.memory_start, 'lineno')[:TOP_N]]
+
+        with open(f'{base}.summary.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(report) + '\n')
+        logging.info(f"Profile written to {base}.trace.json\n{self.trace.summary()}")
+        self.trace = self.profile = self.memory_start = None
+        return base
+
+
+PROFILER = Profiler()
+
+
+# Timing span of a pipeline stage; a shared no-op object when profiling is off
+def span(name, **args):
+    trace = PROFILER.trace
+    if trace is None:
+        return NULL_SPAN
+    return Span(trace, name, args)
+
+
+def start(modes=None):
+    modes = modes or os.environ.get(PROFILE_ENV)
+    if modes and modes not in ('0', 'false', 'off'):
+        PROFILER.start(modes)
+
+
+def stop(label):
+    return PROFILER.stop(label)
@@ -0,0 +1,235 @@
+import re
+import time
+import logging
+import argparse
+from collections import OrderedDict, deque
+from datetime import datetime
+import pytz
+from UMB_API import API_CREDENTIALS
+from EDR_API import EDR_CREDENTIALS
+from UMB_to_SIEM import UmbrellaSource
+from EDR_to_SIEM import EDRSource
+from Tenant_Sharding import owned_credentials
+from Collector_Core import run_collector
+from Load_Shedding import THREAT_EVENT_TYPES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# A blocked Umbrella request and an EDR detection on the same host within this window are correlated
+WINDOW_SECONDS = 30 * 60
+
+# Memory bounds of the index: hosts per side, events kept per host and correlated pairs remembered
+MAX_HOSTS = 50000
+MAX_EVENTS_PER_HOST = 20
+MAX_EMITTED = 100000
+
+# Only correlate events of the same organization (hostnames repeat across customers)
+SAME_ORGANIZATION = True
+
+madrid_tz = pytz.timezone('Europe/Madrid')
+IP_ADDRESS = re.compile(r'^[0-9.]+$|:')
+GEOIP_FIELDS = [f'{field}_{suffix}' for field in ('internalip', 'externalip') for suffix in ('country', 'asn', 'org')]
+
+
+# Function to normalize a hostname: lower case, no domain suffix and no trailing '$' of machine accounts
+def normalize_hostname(name):
+    if not name or not isinstance(name, str):
+        return None
+    name = name.strip().lower().rstrip('$')
+    if not name:
+        return None
+    if IP_ADDRESS.search(name):
+        return name
+    return name.split('.', 1)[0]
+
+
+def event_seconds(event):
+    timestamp = event.get('timestamp')
+    if not isinstance(timestamp, (int, float)):
+        return None
+    return timestamp / 1000 if timestamp > 1e11 else timestamp  # Umbrella uses milliseconds
+
+
+def label_of(event, key):
+    value = event.get(key)
+    if isinstance(value, dict):
+        return value.get('label')
+    return event.get(f'{key}.label', value)
+
+
+# Fields of each side kept in the index and copied to the correlated event
+def summarize_umb(event):
+    summary = {
+        'organization': event.get('organization'),
+        'umb_domain': event.get('domain'),
+        'umb_category': label_of(event, 'policycategories_0'),
+        'umb_identity': label_of(event, 'identities_0'),
+        'umb_internalip': event.get('internalip'),
+        'umb_externalip': event.get('externalip'),
+    }
+    # GeoIP fields added by the enrichment stage (--geoip), which runs before the correlator
+    for field in GEOIP_FIELDS:
+        if field in event:
+            summary[f'umb_{field}'] = event[field]
+    return summary
+
+
+def summarize_edr(event):
+    file_info = event.get('file') or {}
+    return {
+        'organization': event.get('organization'),
+        'edr_event_id': event.get('id'),
+        'edr_event_type': event.get('event_type'),
+        'edr_detection': event.get('detection'),
+        'edr_severity': event.get('severity'),
+        'edr_file_name': file_info.get('file_name'),
+        'edr_sha256': (file_info.get('identity') or {}).get('sha256'),
+    }
+
+
+# Only EDR detections are correlated, not scans, policy updates or other informational events
+def is_detection(event):
+    if event.get('detection'):
+        return True
+    event_type = str(event.get('event_type') or '').lower()
+    return any(threat in event_type for threat in THREAT_EVENT_TYPES)
+
+
+SIDES = {
+    'UMB': (lambda event: normalize_hostname(label_of(event, 'identities_0')), summarize_umb),
+    'EDR': (lambda event: normalize_hostname((event.get('computer') or {}).get('hostname')), summarize_edr),
+}
+OTHER_SIDE = {'UMB': 'EDR', 'EDR': 'UMB'}
+
+
+class Correlator:
+    """Time-windowed index of UMB and EDR events keyed by normalized hostname, used as a pipeline stage."""
+
+    def __init__(self, window=WINDOW_SECONDS, max_hosts=MAX_HOSTS, max_events_per_host=MAX_EVENTS_PER_HOST,
+                 same_organization=SAME_ORGANIZATION, correlated_only=False):
+        self.window = window
+        self.correlated_only = correlated_only
+        self.max_hosts = max_hosts
+        self.max_events_per_host = max_events_per_host
+        self.same_organization = same_organization
+        self.indexes = {tool: OrderedDict() for tool in SIDES}  # host -> deque of (seconds, summary), oldest host first
+        self.emitted = OrderedDict()
+        self.watermark = 0
+        self.stats = {'observed': 0, 'correlated': 0, 'evicted': 0}
+
+    def __call__(self, events):
+        correlated = []
+        for event in events:
+            tool = event.get('tool')
+            if tool == 'UMB' or (tool == 'EDR' and is_detection(event)):
+                correlated.extend(self.observe(tool, event))
+        if correlated:
+            logging.info(f"Correlated {len(correlated)} Umbrella/EDR events")
+        if self.correlated_only:
+            return correlated
+        return events + correlated if correlated else events
+
+    def observe(self, tool, event):
+        get_host, summarize = SIDES[tool]
+        host = get_host(event)
+        seconds = event_seconds(event)
+        if not host or seconds is None:
+            return []
+        self.stats['observed'] += 1
+        self.watermark = max(self.watermark, seconds)
+        summary = summarize(event)
+
+        matches = []
+        for other_seconds, other in self.indexes[OTHER_SIDE[tool]].get(host, ()):
+            if abs(seconds - other_seconds) > self.window:
+                continue
+            if self.same_organization and summary['organization'] != other['organization']:
+                continue
+            if tool == 'UMB':
+                umb, umb_seconds, edr, edr_seconds = summary, seconds, other, other_seconds
+            else:
+                umb, umb_seconds, edr, edr_seconds = other, other_seconds, summary, seconds
+            key = (host, umb['umb_domain'], edr['edr_event_id'] or edr_seconds)
+            if key in self.emitted:
+                continue
+            self.remember(key)
+            matches.append(build_correlated_event(host, umb, umb_seconds, edr, edr_seconds))
+
+        self.add(tool, host, seconds, summary)
+        self.evict()
+        self.stats['correlated'] += len(matches)
+        return matches
+
+    def add(self, tool, host, seconds, summary):
+        index = self.indexes[tool]
+        entries = index.get(host)
+        if entries is None:
+            entries = index[host] = deque(maxlen=self.max_events_per_host)
+        else:
+            index.move_to_end(host)
+        entries.append((seconds, summary))
+        if len(index) > self.max_hosts:
+            index.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    # Drop the hosts not seen within the window (least recently updated first)
+    def evict(self):
+        cutoff = self.watermark - self.window
+        for index in self.indexes.values():
+            while index:
+                host, entries = next(iter(index.items()))
+                if max(seconds for seconds, _ in entries) >= cutoff:
+                    break
+                del index[host]
+                self.stats['evicted'] += 1
+
+    def remember(self, key):
+        self.emitted[key] = True
+        if len(self.emitted) > MAX_EMITTED:
+            self.emitted.popitem(last=False)
+
+
+# Function to build the enriched event sent to Graylog for a correlated pair
+def build_correlated_event(host, umb, umb_seconds, edr, edr_seconds):
+    detected = datetime.fromtimestamp(max(umb_seconds, edr_seconds), pytz.utc).astimezone(madrid_tz)
+    event = {
+        'tool': 'CORR',
+        'hostname': host,
+        'timestamp': max(umb_seconds, edr_seconds),
+        'delta_seconds': round(edr_seconds - umb_seconds),
+        'date': detected.strftime('%Y-%m-%d'),
+        'time': detected.strftime('%H:%M:%S'),
+    }
+    event.update(umb)
+    event.update(edr)
+    event['organization'] = edr['organization'] or umb['organization']
+    event['message'] = f"{host}: blocked {umb['umb_domain']} ({umb['umb_category']}) and EDR {edr['edr_event_type']}"
+    return event
+
+
+# Without --correlated-only the Umbrella and EDR events are sent too, so this script replaces the
+# UMB_to_SIEM.py and EDR_to_SIEM.py jobs; next to them, run it with --correlated-only to avoid double ingest
+def main():
+    parser = argparse.ArgumentParser(description='Collect Umbrella and EDR together and correlate them per host. '
+                                                 'Replaces the UMB and EDR collector jobs unless --correlated-only.')
+    parser.add_argument('--window', type=int, default=WINDOW_SECONDS // 60, help='Correlation window in minutes')
+    parser.add_argument('--interval', type=int, default=0,
+                        help='Keep running, collecting every INTERVAL seconds, so the index spans several runs')
+    parser.add_argument('--correlated-only', action='store_true',
+                        help='Only send the correlated events (when the UMB and EDR collectors also run)')
+    args, collector_args = parser.parse_known_args()
+
+    correlator = Correlator(window=args.window * 60, correlated_only=args.correlated_only)
+    while True:
+        sources = [UmbrellaSource(credentials) for credentials in owned_credentials('UMB', API_CREDENTIALS)]
+        sources += [EDRSource(creds) for creds in owned_credentials('EDR', EDR_CREDENTIALS)]
+        run_collector('UMB+EDR', sources, collector_args, stages=[correlator])
+        logging.info(f"Correlation index: {correlator.stats}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+import os
+import sys
+import gzip
+import json
+import logging
+import argparse
+import importlib
+from urllib.parse import quote, unquote
+from datetime import datetime, timezone
+
+# Local archive of the raw records returned by the vendor APIs, before projection, grouping and transform,
+# partitioned as <dir>/tool=UMB/org=<org>/hour=2024-05-01T13/part-*. Files are Parquet (zstd) when the
+# optional 'pyarrow' package is installed and gzip JSON lines otherwise. Enabled with --archive DIR or the
+# SOC_ARCHIVE_DIR variable; query it with this script, or replay it through the collectors' transform.
+ARCHIVE_ENV = 'SOC_ARCHIVE_DIR'
+FLUSH_EVENTS = 50000  # buffered events written out before the end of a run
+REPLAY_BATCH = 1000
+HOUR_FORMAT = '%Y-%m-%dT%H'
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+NATIVE_TYPES = (str, int, float, bool)
+
+# Parquet column listing, per row, the keys the record did not have (the other rows' columns read back as None)
+ABSENT_COLUMN = '__absent__'
+
+# Time field of the raw records: UMB/EDR/DUO 'timestamp' (epoch), DUO 'isotimestamp', MER 'ts', EDR 'date'
+TIME_FIELDS = ('timestamp', 'isotimestamp', 'ts', 'date')
+
+# Source adapter of each tool, whose transform turns replayed records into Graylog events
+SOURCES = {
+    'UMB': ('UMB_to_SIEM', 'UmbrellaSource'),
+    'EDR': ('EDR_to_SIEM', 'EDRSource'),
+    'DUO': ('DUO_to_SIEM', 'DuoSource'),
+    'MER': ('MER_to_SIEM', 'MerakiSource'),
+}
+
+
+# Function to get the UTC hour of a record: epoch seconds or milliseconds, or an ISO 8601 string
+def event_hour(event):
+    timestamp = next((event[key] for key in TIME_FIELDS if event.get(key)), None)
+    try:
+        if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+            dt = datetime.fromtimestamp(timestamp / 1000 if timestamp > 1e11 else timestamp, timezone.utc)
+        elif isinstance(timestamp, str):
+            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            dt = dt.astimezone(timezone.utc) if dt.tzinfo else dt
+        else:
+            return None
+    except (ValueError, OverflowError, OSError):
+        return None
+    return dt.strftime(HOUR_FORMAT)
+
+
+def partition_dir(root, tool, organization, hour):
+    return os.path.join(root, f'tool={tool}', f"org={quote(str(organization), safe='')}", f'hour={hour}')
+
+
+# Function to turn events into columns; nested or mixed-type columns are stored as JSON strings
+def to_columns(events):
+    names = list(dict.fromkeys(key for event in events for key in event))
+    columns = {}
+    json_columns = []
+    for name in names:
+        values = [event.get(name) for event in events]
+        types = {type(value) for value in values if value is not None}
+        if len(types) == 1 and types.pop() in NATIVE_TYPES:
+            try:
+                columns[name] = pa.array(values)
+                continue
+            except (pa.ArrowInvalid, OverflowError):
+                pass
+        columns[name] = pa.array([None if value is None else json.dumps(value) for value in values], pa.string())
+        json_columns.append(name)
+    absent = [[name for name in names if name not in event] for event in events]
+    if any(absent):
+        columns[ABSENT_COLUMN] = pa.array([json.dumps(keys) if keys else None for keys in absent], pa.string())
+    table = pa.table(columns)
+    return table.replace_schema_metadata({'json_columns': json.dumps(json_columns)})
+
+
+class EventArchive:
+    """Buffers the raw records of a run per (tool, organization, hour) and writes one file per partition."""
+
+    def __init__(self, root, flush_events=FLUSH_EVENTS):
+        self.root = root
+        self.flush_events = flush_events
+        self.buffers = {}  # (tool, organization, hour) -> events
+        self.buffered = 0
+        self.run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{os.getpid()}"
+        self.parts = 0
+        self.stats = {'archived': 0, 'files': 0}
+
+    def __call__(self, tool, organization, records):
+        run_hour = datetime.now(timezone.utc).strftime(HOUR_FORMAT)
+        for record in records:
+            key = (tool or 'unknown', organization or 'unknown', event_hour(record) or run_hour)
+            # A copy: transforms may label the records in place (EDR without projection) before the flush
+            self.buffers.setdefault(key, []).append(dict(record))
+        self.buffered += len(records)
+        if self.buffered >= self.flush_events:
+            self.flush()
+
+    def flush(self):
+        for (tool, organization, hour), events in self.buffers.items():
+            directory = partition_dir(self.root, tool, organization, hour)
+            os.makedirs(directory, exist_ok=True)
+            self.parts += 1
+            path = os.path.join(directory, f'part-{self.run_id}-{self.parts:04d}')
+            try:
+                self.write(path, events)
+            except Exception as e:
+                logging.error(f"Error archiving {len(events)} {tool} records of {organization}: {e}")
+                continue
+            self.stats['archived'] += len(events)
+            self.stats['files'] += 1
+        self.buffers = {}
+        self.buffered = 0
+
+    @staticmethod
+    def write(path, events):
+        if pq:
+            tmp_path = f'{path}.parquet.tmp'
+            pq.write_table(to_columns(events), tmp_path, compression='zstd')
+            os.replace(tmp_path, f'{path}.parquet')
+        else:
+            tmp_path = f'{path}.jsonl.gz.tmp'
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                for event in events:
+                    f.write(json.dumps(event) + '\n')
+            os.replace(tmp_path, f'{path}.jsonl.gz')
+
+    def close(self):
+        self.flush()
+        logging.info(f"Archive {self.root}: {self.stats}")
+
+
+# Function to build the archive sink from --archive or SOC_ARCHIVE_DIR (None when not configured)
+def get_archive(root=None):
+    root = root or os.environ.get(ARCHIVE_ENV)
+    return EventArchive(root) if root else None
+
+
+def partition_value(name):
+    return unquote(name.partition('=')[2])
+
+
+# Function to list the (tool, organization, path) of the files of the matching partitions, oldest hour first
+def list_files(root, tools=None, organizations=None, start=None, end=None):
+    start_hour = start.astimezone(timezone.utc).strftime(HOUR_FORMAT) if start else None
+    end_hour = end.astimezone(timezone.utc).strftime(HOUR_FORMAT) if end else None
+    files = []
+    for tool_dir in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        if tools and partition_value(tool_dir) not in tools:
+            continue
+        for org_dir in sorted(os.listdir(os.path.join(root, tool_dir))):
+            if organizations and partition_value(org_dir) not in organizations:
+                continue
+            for hour_dir in sorted(os.listdir(os.path.join(root, tool_dir, org_dir))):
+                hour = partition_value(hour_dir)
+                if (start_hour and hour < start_hour) or (end_hour and hour > end_hour):
+                    continue
+                directory = os.path.join(root, tool_dir, org_dir, hour_dir)
+                files += [(hour, partition_value(tool_dir), partition_value(org_dir), os.path.join(directory, name))
+                          for name in sorted(os.listdir(directory)) if name.endswith(('.parquet', '.jsonl.gz'))]
+    return [(tool, organization, path) for _, tool, organization, path in sorted(files)]
+
+
+def matches(event, where, contains):
+    for field, value in where:
+        if str(event.get(field)) != value:
+            return False
+    for field, value in contains:
+        if value not in str(event.get(field, '')):
+            return False
+    return True
+
+
+# Function to read the events of one file, only the given columns (all when None)
+def read_file(path, columns=None, where=(), contains=()):
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise RuntimeError(f"Reading {path} needs the 'pyarrow' package")
+        parquet = pq.ParquetFile(path)
+        names = parquet.schema_arrow.names
+        table = parquet.read(columns=[name for name in names if name in columns or name == ABSENT_COLUMN]
+                             if columns else None)
+        metadata = table.schema.metadata or {}
+        json_columns = set(json.loads(metadata.get(b'json_columns', b'[]')))
+        for row in table.to_pylist():
+            absent = row.pop(ABSENT_COLUMN, None)
+            event = {key: json.loads(value) if key in json_columns and value is not None else value
+                     for key, value in row.items()}
+            for key in json.loads(absent) if absent else ():
+                event.pop(key, None)
+            if matches(event, where, contains):
+                yield event
+        return
+
+    # Values as they appear in the JSON text; True/False/None are spelled differently there
+    needles = [json.dumps(value)[1:-1] for _, value in list(where) + list(contains) if value not in ('True', 'False', 'None')]
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            # Cheap check on the raw line before parsing it
+            if any(needle not in line for needle in needles):
+                continue
+            event = json.loads(line)
+            if matches(event, where, contains):
+                yield {key: event[key] for key in columns if key in event} if columns else event
+
+
+# Function to read the matching records as (tool, organization, record)
+def scan(root, tools=None, organizations=None, start=None, end=None, columns=None, where=(), contains=()):
+    # The filtered fields are read too, then dropped from the output
+    read_columns = (set(columns) | {field for field, _ in where} | {field for field, _ in contains}) if columns else None
+    for tool, organization, path in list_files(root, tools, organizations, start, end):
+        for event in read_file(path, read_columns, where, contains):
+            yield tool, organization, {key: event[key] for key in columns if key in event} if columns else event
+
+
+def parse_filter(value):
+    field, separator, expected = value.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected FIELD=VALUE, got {value!r}")
+    return field, expected
+
+
+def get_source(tool, organization):
+    module_name, class_name = SOURCES[tool]
+    return getattr(importlib.import_module(module_name), class_name)({'ORG': organization})
+
+
+# Function to re-send archived records: each batch of one (tool, organization) goes through the current
+# transform of its collector (projection, grouping, labels), then to the sender
+def replay(records, sender, batch_size=REPLAY_BATCH):
+    sent = 0
+    batch = []
+    current = None
+
+    def flush():
+        tool, organization = current
+        events = get_source(tool, organization).transform(organization, batch)
+        return sender(events) if events else 0
+
+    for tool, organization, record in records:
+        if batch and (len(batch) == batch_size or (tool, organization) != current):
+            sent += flush()
+            batch = []
+        current = (tool, organization)
+        batch.append(record)
+    if batch:
+        sent += flush()
+    return sent
+
+
+def main():
+    from Collector_Core import parse_time, send_to_graylog
+
+    parser = argparse.ArgumentParser(description='Query the local archive of raw vendor records or replay it to Graylog.')
+    parser.add_argument('command', choices=['query', 'replay'])
+    parser.add_argument('--archive', default=os.environ.get(ARCHIVE_ENV), help=f'Archive directory (default: ${ARCHIVE_ENV})')
+    parser.add_argument('--tool', action='append', help='Only these tools (repeatable)')
+    parser.add_argument('--org', action='append', help='Only these organizations (repeatable)')
+    parser.add_argument('--from', dest='start', type=parse_time, help='First hour to read, ISO 8601 (naive times are UTC)')
+    parser.add_argument('--to', dest='end', type=parse_time, help='Last hour to read, ISO 8601 (naive times are UTC)')
+    parser.add_argument('--where', action='append', type=parse_filter, default=[], metavar='FIELD=VALUE',
+                        help='Only records whose (raw, top level) field equals VALUE (repeatable)')
+    parser.add_argument('--contains', action='append', type=parse_filter, default=[], metavar='FIELD=TEXT',
+                        help='Only records whose (raw, top level) field contains TEXT (repeatable)')
+    parser.add_argument('--columns', help='Comma separated fields to output (query only; default: all)')
+    parser.add_argument('--count', action='store_true', help='Only print the number of matching records')
+    args = parser.parse_args()
+    if not args.archive:
+        parser.error(f'--archive or ${ARCHIVE_ENV} is required')
+
+    columns = args.columns.split(',') if args.columns and args.command == 'query' else None
+    if args.count and not columns:
+        columns = [field for field, _ in args.where + args.contains] or None
+    records = scan(args.archive, args.tool, args.org, args.start, args.end, columns, args.where, args.contains)
+
+    if args.command == 'replay':
+        logging.info(f"Replayed {replay(records, send_to_graylog)} events to Graylog")
+    elif args.count:
+        print(sum(1 for _ in records))
+    else:
+        for tool, organization, record in records:
+            sys.stdout.write(json.dumps({'tool': tool, 'organization': organization, **record}, default=str) + '\n')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
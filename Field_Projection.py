@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import logging
+from fnmatch import translate
+
+# Per-tool projection of the events sent to Graylog. Fields are addressed by their output name:
+# flattened keys for UMB/DUO ('categories_0') and dotted paths for the nested EDR/MER events
+# ('event.signature'). Patterns accept shell wildcards.
+#   keep      only these fields are sent (omit to keep everything not dropped)
+#   drop      fields never sent
+#   rename    {field: new name}
+#   truncate  {field: max characters} for string values
+PROJECTION_SPECS = {
+    'UMB': {
+        # 'categories' repeats every category of the domain, 'policycategories' holds the ones that matched
+        'drop': ['categories_*', 'allapplications_*', 'allowedapplications_*', 'blockedapplications_*'],
+    },
+    'MER': {
+        # 'signature', 'message' and 'ts' are already top level fields of the log entry
+        'drop': ['event.signature', 'event.message', 'event.ts'],
+        'truncate': {'event.uri': 512},
+    },
+    'EDR': {
+        # API hyperlinks back to the console
+        'drop': ['links', 'computer.links'],
+        'truncate': {'file.parent.file_name': 256, 'command_line.arguments': 1024},
+    },
+    'DUO': {
+        'drop': ['adaptive_trust_assessments_*'],
+    },
+}
+
+# Optional JSON file overriding the specs above, e.g. {"UMB": {"keep": [...]}, "EDR": null}
+PROJECTION_FILE = os.environ.get('SOC_PROJECTION_FILE')
+
+# One event out of SAMPLE_EVERY is serialized with and without projection to report the savings
+SAMPLE_EVERY = 50
+
+
+def compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{translate(pattern)})' for pattern in patterns))
+
+
+class Projection:
+    """Compiled keep/drop/rename/truncate spec; per-field decisions are memoized."""
+
+    def __init__(self, spec):
+        self.keep = compile_patterns(spec.get('keep'))
+        self.keep_prefixes = [re.split(r'[*?\[]', pattern)[0] for pattern in spec.get('keep') or []]
+        self.drop = compile_patterns(spec.get('drop'))
+        self.rename = dict(spec.get('rename') or {})
+        self.truncate = [(compile_patterns([pattern]), limit) for pattern, limit in (spec.get('truncate') or {}).items()]
+        self.fields = {}
+        self.limits = {}
+
+    # Output name of a field, or None when it must not be materialized
+    def field(self, path, kept=False):
+        cache_key = (path, kept)
+        if cache_key not in self.fields:
+            if self.drop and self.drop.match(path):
+                name = None
+            elif self.keep and not kept and not self.keep.match(path):
+                name = None
+            else:
+                name = self.rename.get(path, path)
+            self.fields[cache_key] = name
+        return self.fields[cache_key]
+
+    # Whether a nested object may contain fields to keep; sep joins the keys of the flattened output
+    # ('.' for nested paths, '_' for DUO's flattened keys)
+    def descend(self, path, kept=False, sep='.'):
+        if self.drop and self.drop.match(path):
+            return False
+        if kept or not self.keep or self.keep.match(path):
+            return True
+        return any(prefix.startswith(f'{path}{sep}') or f'{path}{sep}'.startswith(prefix) for prefix in self.keep_prefixes)
+
+    def value(self, path, value):
+        if path not in self.limits:
+            self.limits[path] = next((limit for pattern, limit in self.truncate if pattern.match(path)), None)
+        limit = self.limits[path]
+        if limit and isinstance(value, str) and len(value) > limit:
+            return value[:limit]
+        return value
+
+    # Store a flattened field in target if the spec allows it
+    def emit(self, target, path, value):
+        name = self.field(path)
+        if name:
+            target[name] = self.value(path, value)
+
+    # Project a nested object, keeping its structure
+    def project(self, record, prefix='', kept=False):
+        projected = {}
+        for key, value in record.items():
+            path = f'{prefix}.{key}' if prefix else key
+            if isinstance(value, dict):
+                if not self.descend(path, kept):
+                    continue
+                subtree_kept = kept or bool(self.keep and self.keep.match(path))
+                value = self.project(value, path, subtree_kept)
+                if not value and not subtree_kept:
+                    continue
+                name = self.rename.get(path, path)
+            else:
+                name = self.field(path, kept)
+                if not name:
+                    continue
+                value = self.value(path, value)
+            projected[name.rpartition('.')[2]] = value
+        return projected
+
+
+class ProjectionStats:
+    """Serialized bytes per event with and without projection, measured on a sample of events."""
+
+    def __init__(self, sample_every=SAMPLE_EVERY):
+        self.sample_every = sample_every
+        self.seen = {}
+        self.measured = {}  # tool -> [events, bytes before, bytes after]
+
+    def sample(self, tool):
+        self.seen[tool] = self.seen.get(tool, 0) + 1
+        return self.seen[tool] % self.sample_every == 1 or self.sample_every == 1
+
+    def record(self, tool, before, after):
+        stats = self.measured.setdefault(tool, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += len(json.dumps(before))
+        stats[2] += len(json.dumps(after))
+
+    def report(self):
+        for tool, (events, before, after) in sorted(self.measured.items()):
+            logging.info(f"{tool} projection: {before / events:.0f} bytes/event before, {after / events:.0f} after "
+                         f"({100 * (before - after) / max(before, 1):.1f}% saved, {events} sampled events)")
+
+
+def load_specs(path=PROJECTION_FILE):
+    specs = dict(PROJECTION_SPECS)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            specs.update(json.load(f))
+    return specs
+
+
+# Function to get the compiled projection of a tool (None when disabled)
+def get_projection(tool):
+    spec = SPECS.get(tool)
+    if not spec:
+        return None
+    if tool not in COMPILED:
+        COMPILED[tool] = Projection(spec)
+    return COMPILED[tool]
+
+
+SPECS = load_specs()
+COMPILED = {}
+STATS = ProjectionStats()
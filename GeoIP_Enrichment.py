@@ -0,0 +1,280 @@
+import os
+import csv
+import sys
+import mmap
+import socket
+import struct
+import logging
+import argparse
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+# GeoIP/ASN enrichment stage: adds {field}_country, {field}_asn and {field}_org to the IP fields below.
+# Databases are MaxMind MMDB files (needs the optional 'maxminddb' package) or CSV files with the
+# columns start,end,country,asn,org, converted once to a sorted-array index (<file>.idx) and opened
+# with mmap. Enabled with --geoip or the SOC_GEOIP_DB variable (several paths separated by os.pathsep).
+GEOIP_ENV = 'SOC_GEOIP_DB'
+SAMPLE_DATABASE = 'GeoIP_Sample.csv'
+CACHE_SIZE = 65536
+
+# IP fields enriched per tool: top level keys of the flattened events, dotted paths in nested ones
+ENRICHED_FIELDS = {
+    'UMB': ['internalip', 'externalip'],
+    'MER': ['event.srcIp', 'event.destIp'],
+}
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+INDEX_MAGIC = b'SOCGEO1\0'
+INDEX_HEADER = struct.Struct('<8sBxxxII')  # magic, byte order, ranges, records
+
+
+# Function to get the address of an IP field, without the port Meraki appends ('10.0.0.5:443', '[::1]:443')
+def strip_port(value):
+    if not value or not isinstance(value, str):
+        return None
+    if value.startswith('['):
+        return value[1:].partition(']')[0]
+    if value.count(':') == 1:
+        return value.partition(':')[0]
+    return value
+
+
+def ipv4_to_int(ip):
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except (OSError, ValueError):
+        return None
+
+
+def parse_ipv4(value):
+    return int(value) if value.isdigit() else ipv4_to_int(value)
+
+
+# Function to convert a CSV database into the sorted-array index read by RangeIndex:
+# header, range starts, range ends and record numbers (uint32 each), record offsets and the record strings
+def build_index(csv_path, index_path):
+    ranges = []
+    records = {}
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            start, end = parse_ipv4(row['start']), parse_ipv4(row['end'])
+            if start is None or end is None:
+                continue  # IPv6 ranges need an MMDB database
+            record = '\x1f'.join((row.get('country') or '', row.get('asn') or '', row.get('org') or ''))
+            ranges.append((start, end, records.setdefault(record, len(records))))
+    ranges.sort()
+
+    strings = b''.join(record.encode() for record in records)
+    offsets = array('I', [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record.encode()))
+
+    byte_order = 1 if sys.byteorder == 'little' else 0
+    tmp_path = f'{index_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, byte_order, len(ranges), len(records)))
+        for column in range(3):
+            array('I', (entry[column] for entry in ranges)).tofile(f)
+        offsets.tofile(f)
+        f.write(strings)
+    os.replace(tmp_path, index_path)
+    logging.info(f"Built GeoIP index {index_path}: {len(ranges)} ranges, {len(records)} records")
+    return index_path
+
+
+class RangeIndex:
+    """IPv4 ranges of a CSV database, memory-mapped and searched with bisect."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, count, records = INDEX_HEADER.unpack_from(self.map)
+        if magic != INDEX_MAGIC or byte_order != (sys.byteorder == 'little'):
+            raise ValueError(f"{path} is not a GeoIP index built on this machine")
+        self.view = memoryview(self.map)
+        position = INDEX_HEADER.size
+        self.starts, self.ends, self.records = (self.view[position + 4 * count * i:position + 4 * count * (i + 1)].cast('I')
+                                                for i in range(3))
+        position += 12 * count
+        self.offsets = self.view[position:position + 4 * (records + 1)].cast('I')
+        self.strings = self.view[position + 4 * (records + 1):]
+        self.decoded = {}
+
+    def record(self, number):
+        if number not in self.decoded:
+            raw = bytes(self.strings[self.offsets[number]:self.offsets[number + 1]]).decode()
+            country, asn, org = raw.split('\x1f')
+            self.decoded[number] = {key: value for key, value in
+                                    (('country', country), ('asn', int(asn) if asn.isdigit() else asn), ('org', org))
+                                    if value}
+        return self.decoded[number]
+
+    # Function to look up many IPs: sorted so each binary search starts where the previous one ended
+    def lookup_many(self, ips):
+        found = {}
+        numbers = sorted((number, ip) for ip, number in ((ip, ipv4_to_int(ip)) for ip in ips) if number is not None)
+        low = 0
+        for number, ip in numbers:
+            low = bisect_right(self.starts, number, low) - 1
+            if low >= 0 and number <= self.ends[low]:
+                found[ip] = self.record(self.records[low])
+            low = max(low, 0)
+        return found
+
+    def close(self):
+        for view in (self.starts, self.ends, self.records, self.offsets, self.strings, self.view):
+            view.release()
+        self.map.close()
+        self.file.close()
+
+
+class MMDBDatabase:
+    """MaxMind country/city or ASN database opened in mmap mode."""
+
+    def __init__(self, path):
+        self.reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+    def lookup_many(self, ips):
+        found = {}
+        for ip in ips:
+            try:
+                data = self.reader.get(ip)
+            except ValueError:
+                continue
+            if not data:
+                continue
+            country = (data.get('country') or data.get('registered_country') or {}).get('iso_code')
+            result = {'country': country, 'asn': data.get('autonomous_system_number'),
+                      'org': data.get('autonomous_system_organization')}
+            result = {key: value for key, value in result.items() if value}
+            if result:
+                found[ip] = result
+        return found
+
+    def close(self):
+        self.reader.close()
+
+
+# Function to open a database; the index of a CSV file is (re)built when missing or older than the CSV
+def open_database(path):
+    if path.endswith('.mmdb'):
+        if maxminddb is None:
+            raise RuntimeError(f"Reading {path} needs the 'maxminddb' package")
+        return MMDBDatabase(path)
+    if path.endswith('.csv'):
+        index_path = f'{path}.idx'
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(path):
+            build_index(path, index_path)
+        path = index_path
+    return RangeIndex(path)
+
+
+def resolve(event, path):
+    value = event
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+class GeoIPEnricher:
+    """Pipeline stage adding country/ASN/org fields to the IP fields of each event, with an LRU of hot IPs."""
+
+    def __init__(self, databases, cache_size=CACHE_SIZE, fields=None):
+        self.databases = databases
+        self.cache_size = cache_size
+        self.fields = fields or ENRICHED_FIELDS
+        self.cache = OrderedDict()  # ip -> merged result (None when no database knows it)
+        self.stats = {'lookups': 0, 'hits': 0, 'enriched': 0}
+
+    def __call__(self, events):
+        targets = []
+        for event in events:
+            for path in self.fields.get(event.get('tool'), ()):
+                ip = strip_port(resolve(event, path))
+                if ip:
+                    targets.append((event, path.rpartition('.')[2], ip))
+        if not targets:
+            return events
+
+        results = self.lookup_many({ip for _, _, ip in targets})
+        for event, field, ip in targets:
+            result = results.get(ip)
+            if result:
+                for key, value in result.items():
+                    event[f'{field}_{key}'] = value
+                self.stats['enriched'] += 1
+        return events
+
+    def lookup_many(self, ips):
+        results = {}
+        misses = []
+        for ip in ips:
+            if ip in self.cache:
+                self.cache.move_to_end(ip)
+                results[ip] = self.cache[ip]
+            else:
+                misses.append(ip)
+        self.stats['lookups'] += len(ips)
+        self.stats['hits'] += len(ips) - len(misses)
+
+        found = {}
+        for database in self.databases:
+            for ip, result in database.lookup_many(misses).items():
+                merged = found.setdefault(ip, {})
+                for key, value in result.items():
+                    merged.setdefault(key, value)  # the first database listed wins
+        for ip in misses:
+            results[ip] = self.cache[ip] = found.get(ip)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return results
+
+    def lookup(self, ip):
+        ip = strip_port(ip)
+        return self.lookup_many([ip]).get(ip)
+
+    def close(self):
+        logging.info(f"GeoIP enrichment: {self.stats}")
+        for database in self.databases:
+            database.close()
+
+
+# Function to build the enrichment stage from --geoip paths or SOC_GEOIP_DB (None when not configured)
+def get_enricher(paths=None):
+    if not paths:
+        paths = [path for path in os.environ.get(GEOIP_ENV, '').split(os.pathsep) if path]
+    if not paths:
+        return None
+    return GeoIPEnricher([open_database(path) for path in paths])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build GeoIP indexes and look up IPs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='Convert a CSV database (start,end,country,asn,org) to an index')
+    build.add_argument('csv_path')
+    build.add_argument('-o', '--output', help='Index path (default: <csv>.idx)')
+    lookup = commands.add_parser('lookup', help='Look up IPs')
+    lookup.add_argument('ips', nargs='+')
+    lookup.add_argument('--db', action='append', help=f'Database (default: ${GEOIP_ENV} or {SAMPLE_DATABASE})')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_index(args.csv_path, args.output or f'{args.csv_path}.idx')
+        return
+    enricher = get_enricher(args.db) or get_enricher([SAMPLE_DATABASE])
+    for ip in args.ips:
+        print(f"{ip}\t{enricher.lookup(ip)}")
+    enricher.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from collections import deque
+
+# Bounded priority queue between fetch and send. Events wait in one FIFO per priority level and are
+# sent highest level first at SEND_RATE; when more than QUEUE_BUDGET events are waiting, the newest
+# events of the lowest level are shed and summarized as one event per (tool, organization, key).
+QUEUE_BUDGET = 20000
+SEND_RATE = 2000  # events per second accepted by the Graylog input
+SEND_BATCH = 500
+
+THREAT_CATEGORIES = ('malware', 'phishing', 'command and control', 'cryptomining', 'dns tunneling')
+THREAT_EVENT_TYPES = ('threat', 'exploit', 'malicious', 'quarantine failure', 'compromise')
+
+
+# Priority rules: event -> (priority, summary key). Higher priorities are sent first and shed last.
+def umb_priority(event):
+    category = event.get('policycategories_0')
+    label = str(category.get('label') if isinstance(category, dict) else category or '').lower()
+    return (80 if any(threat in label for threat in THREAT_CATEGORIES) else 40), event.get('domain')
+
+
+def edr_priority(event):
+    event_type = str(event.get('event_type') or '')
+    if any(threat in event_type.lower() for threat in THREAT_EVENT_TYPES):
+        return 100, event_type
+    if str(event.get('severity') or '').lower() in ('high', 'critical'):
+        return 90, event_type
+    return 50, event_type
+
+
+def mer_priority(event):
+    raw_event = event.get('event') or {}
+    if str(raw_event.get('disposition') or '').lower() == 'malicious':
+        return 85, event.get('signature') or event.get('message')
+    ids_priority = str(raw_event.get('priority') or '')
+    priority = {'1': 75, '2': 60}.get(ids_priority, 30)
+    return priority, event.get('signature') or event.get('message')
+
+
+def duo_priority(event):
+    result = str(event.get('result') or '').lower()
+    return {'fraud': 90, 'denied': 60}.get(result, 20), f"{result}:{event.get('reason')}"
+
+
+PRIORITY_RULES = {
+    'CORR': lambda event: (100, event.get('hostname')),
+    'EDR': edr_priority,
+    'UMB': umb_priority,
+    'MER': mer_priority,
+    'DUO': duo_priority,
+}
+DEFAULT_PRIORITY = 10
+
+
+def get_priority(event):
+    rule = PRIORITY_RULES.get(event.get('tool'))
+    if rule is None:
+        return DEFAULT_PRIORITY, None
+    try:
+        return rule(event)
+    except Exception:
+        return DEFAULT_PRIORITY, None
+
+
+class LoadShedder:
+    """Priority buffer drained at a fixed rate; sheds and summarizes the lowest priorities when over budget."""
+
+    def __init__(self, budget=QUEUE_BUDGET, rate=SEND_RATE, batch=SEND_BATCH):
+        self.budget = budget
+        self.rate = rate
+        self.batch = batch
+        self.levels = {}  # priority -> deque of events
+        self.size = 0
+        self.summaries = {}  # (tool, organization, priority, key) -> summary event
+        self.stats = {'queued': 0, 'sent': 0, 'shed': 0, 'summaries': 0}
+        self.wakeup = None
+        self.closing = False
+
+    def push(self, events):
+        for event in events:
+            priority, key = get_priority(event)
+            self.levels.setdefault(priority, deque()).append((key, event))
+        self.size += len(events)
+        self.stats['queued'] += len(events)
+        if self.size > self.budget:
+            self.shed(self.size - self.budget)
+        if self.wakeup:
+            self.wakeup.set()
+
+    def shed(self, count):
+        for priority in sorted(self.levels):
+            level = self.levels[priority]
+            while level and count:
+                key, event = level.pop()
+                self.summarize(priority, key, event)
+                count -= 1
+                self.size -= 1
+            if not count:
+                return
+
+    def summarize(self, priority, key, event):
+        summary_key = (event.get('tool'), event.get('organization'), priority, str(key))
+        timestamp = event.get('timestamp')
+        summary = self.summaries.get(summary_key)
+        if summary is None:
+            summary = self.summaries[summary_key] = {
+                'tool': event.get('tool'),
+                'organization': event.get('organization'),
+                'shed': True,
+                'priority': priority,
+                'shed_key': str(key),
+                'shed_count': 0,
+                'first_timestamp': timestamp,
+                'last_timestamp': timestamp,
+                'date': event.get('date') or event.get('main_date'),
+            }
+        summary['shed_count'] += 1
+        if timestamp is not None and summary['first_timestamp'] is not None:
+            summary['first_timestamp'] = min(summary['first_timestamp'], timestamp)
+            summary['last_timestamp'] = max(summary['last_timestamp'], timestamp)
+        self.stats['shed'] += 1
+
+    # Function to take up to n events, highest priority first
+    def take(self, n):
+        batch = []
+        for priority in sorted(self.levels, reverse=True):
+            level = self.levels[priority]
+            while level and len(batch) < n:
+                batch.append(level.popleft()[1])
+            if len(batch) == n:
+                break
+        self.size -= len(batch)
+        return batch
+
+    async def drain(self, sender):
+        self.wakeup = asyncio.Event()
+        while True:
+            batch = self.take(self.batch)
+            if batch:
+                self.stats['sent'] += sender(batch)
+                await asyncio.sleep(len(batch) / self.rate)
+            elif self.closing:
+                return
+            else:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+    # Function to finish draining, send the shed summaries and report what was shed
+    async def close(self, drain_task, sender):
+        self.closing = True
+        if self.wakeup:
+            self.wakeup.set()
+        await drain_task
+
+        summaries = sorted(self.summaries.values(), key=lambda summary: summary['shed_count'], reverse=True)
+        for summary in summaries:
+            summary['message'] = (f"Load shedding: {summary['shed_count']} {summary['tool']} events "
+                                  f"(priority {summary['priority']}, {summary['shed_key']}) were summarized")
+        if summaries:
+            self.stats['summaries'] = sender(summaries)
+            logging.warning(f"Shed {self.stats['shed']} low-priority events into {len(summaries)} summaries")
+            for summary in summaries[:10]:
+                logging.warning(f"  {summary['tool']} {summary['organization']} priority {summary['priority']} "
+                                f"{summary['shed_key']}: {summary['shed_count']} events")
+        logging.info(f"Load shedding: {self.stats}")
+        self.summaries = {}
+        return self.stats['sent'] + self.stats['summaries']
@@ -1,115 +1,57 @@
-import requests
-import json
-import socket
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from MER_API import MER_CREDENTIALS
-import concurrent.futures
+from Tenant_Sharding import owned_credentials
+from Collector_Core import Source, run_collector
+from Field_Projection import STATS, get_projection
+from Collector_Profiler import span
 import pytz
 
-class NoRebuildAuthSession(requests.Session):
-    """Custom session to preserve the Authorization header when redirected."""
-    def rebuild_auth(self, prepared_request, response):
-        pass
-
-# Initialize the session
-session = NoRebuildAuthSession()
-
-# Function to get all organizations' IDs and names using the API key
-def get_all_organizations(api_key):
-    url = 'https://api.meraki.com/api/v1/organizations'
-    headers = {'Authorization': f'Bearer {api_key}'}
-    
-    response = session.get(url, headers=headers)
-
-    if response.status_code == 200:
-        organizations = response.json()
-        if organizations:
-            return [(org["id"], org["name"]) for org in organizations]  # Return list of ID and Name
-        else:
-            logging.error("No organizations found.")
-            return []
-    else:
-        logging.error(f"Failed to fetch organizations: {response.status_code}")
-        return []
-
-# Function to fetch security events for the organization
-def fetch_security_events(api_key, organization_id):
-    # Get the current time (t1) and subtract 5 minutes for t0
-    t1 = datetime.utcnow()
-    t0 = t1 - timedelta(minutes=5)
-
-    # Format the times in ISO 8601 format for Meraki's API (YYYY-MM-DDTHH:MM:SSZ)
-    t1_str = t1.strftime('%Y-%m-%dT%H:%M:%SZ')
-    t0_str = t0.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-    url = f'https://api.meraki.com/api/v1/organizations/{organization_id}/appliance/security/events'
-    headers = {'Authorization': f'Bearer {api_key}'}
-    params = {
-        't0': t0_str,  # Start time (5 minutes ago)
-        't1': t1_str,  # End time (current time)
-        'perPage': 1000,  # Number of events per page
-        'sortOrder': 'descending'  # Sort by the most recent events first
-    }
-    
-    events = []
+ORGANIZATIONS_URL = 'https://api.meraki.com/api/v1/organizations'
+EVENTS_URL = 'https://api.meraki.com/api/v1/organizations/{organization_id}/appliance/security/events'
+PAGE_SIZE = 1000
+
+# Madrid Timezone
+madrid_tz = pytz.timezone('Europe/Madrid')
+
+# Fields sent to Graylog (see Field_Projection.py)
+projection = get_projection('MER')
+
+# Function to group repeated events by (signature, message) within 60 seconds
+def group_events(data):
     seen_events = {}  # Dictionary to track grouped events by (signature, message)
 
-    while url:
-        response = session.get(url, headers=headers, params=params)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                for event in data:
-                    event_signature = event.get('signature', '')
-                    event_message = event.get('message', '')
-                    event_key = (event_signature, event_message)
-
-                    if event_key not in seen_events:
-                        seen_events[event_key] = {
-                            "signature": event_signature,
-                            "message": event_message,
-                            "count": 1,
-                            "first_ts": event.get("ts"),
-                            "last_ts": event.get("ts"),
-                            "events": [event]
-                        }
-                    else:
-                        last_ts = seen_events[event_key]["last_ts"]
-                        last_time = datetime.strptime(last_ts, "%Y-%m-%dT%H:%M:%S.%fZ")
-                        event_time = datetime.strptime(event.get("ts"), "%Y-%m-%dT%H:%M:%S.%fZ")
-
-                        if (event_time - last_time).total_seconds() < 60:
-                            seen_events[event_key]["count"] += 1
-                            seen_events[event_key]["last_ts"] = event.get("ts")
-                        else:
-                            seen_events[event_key]["events"].append(event)
-                            seen_events[event_key]["last_ts"] = event.get("ts")
-            else:
-                logging.info("No security events found.")
-            
-            next_page = response.links.get('next', None)
-            if next_page:
-                url = next_page['url']
-            else:
-                break
+    for event in data:
+        event_signature = event.get('signature', '')
+        event_message = event.get('message', '')
+        event_key = (event_signature, event_message)
+
+        if event_key not in seen_events:
+            seen_events[event_key] = {
+                "signature": event_signature,
+                "message": event_message,
+                "count": 1,
+                "first_ts": event.get("ts"),
+                "last_ts": event.get("ts"),
+                "events": [event]
+            }
         else:
-            logging.error(f"Failed to fetch security events: {response.status_code}")
-            break
-    
-    return seen_events
+            last_ts = seen_events[event_key]["last_ts"]
+            last_time = datetime.strptime(last_ts, "%Y-%m-%dT%H:%M:%S.%fZ")
+            event_time = datetime.strptime(event.get("ts"), "%Y-%m-%dT%H:%M:%S.%fZ")
 
-# Function to send events to Graylog via UDP
-def send_to_graylog(events, organization_name):
-    graylog_host = '127.0.0.1'
-    graylog_port = 12201
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if (event_time - last_time).total_seconds() < 60:
+                seen_events[event_key]["count"] += 1
+                seen_events[event_key]["last_ts"] = event.get("ts")
+            else:
+                seen_events[event_key]["events"].append(event)
+                seen_events[event_key]["last_ts"] = event.get("ts")
 
-    total_sent = 0
+    return seen_events
 
-    # Madrid Timezone
-    madrid_tz = pytz.timezone('Europe/Madrid')
+# Function to build the Graylog log entries of the grouped events
+def build_log_entries(events, organization_name, projection=None):
+    log_entries = []
 
     for event_key, event_info in events.items():
         for event in event_info["events"]:
@@ -117,13 +59,14 @@ def send_to_graylog(events, organization_name):
             event_timestamp = event.get("ts")
             if event_timestamp:
                 # Convert the event timestamp from UTC to Madrid time
-                event_datetime_utc = datetime.strptime(event_timestamp, "%Y-%m-%dT%H:%M:%S.%fZ")
-                event_datetime_utc = pytz.utc.localize(event_datetime_utc)  # Localize to UTC
-                event_datetime_madrid = event_datetime_utc.astimezone(madrid_tz)  # Convert to Madrid timezone
-                
-                # Format the time and date in the Madrid timezone
-                event_time = event_datetime_madrid.strftime("%H:%M:%S")  # Time in HH:MM:SS format
-                event_date = event_datetime_madrid.strftime("%Y-%m-%d")  # Date in YYYY-MM-DD format
+                with span('tz_convert'):
+                    event_datetime_utc = datetime.strptime(event_timestamp, "%Y-%m-%dT%H:%M:%S.%fZ")
+                    event_datetime_utc = pytz.utc.localize(event_datetime_utc)  # Localize to UTC
+                    event_datetime_madrid = event_datetime_utc.astimezone(madrid_tz)  # Convert to Madrid timezone
+
+                    # Format the time and date in the Madrid timezone
+                    event_time = event_datetime_madrid.strftime("%H:%M:%S")  # Time in HH:MM:SS format
+                    event_date = event_datetime_madrid.strftime("%Y-%m-%d")  # Date in YYYY-MM-DD format
             else:
                 event_time = event_date = None  # In case timestamp is missing
 
@@ -134,58 +77,76 @@ def send_to_graylog(events, organization_name):
                 "signature": event_info["signature"],
                 "message": event_info["message"],
                 "count": event_info["count"],
-                "event": event,
+                "event": projection.project(event, 'event') if projection else event,
                 "tool": "MER",
                 "time": event_time,  # Time in Madrid timezone
                 "date": event_date   # Date in Madrid timezone
             }
-            message = json.dumps(log_entry)
-            udp_socket.sendto(message.encode(), (graylog_host, graylog_port))
-            total_sent += 1
+            if projection and STATS.sample('MER'):
+                STATS.record('MER', dict(log_entry, event=event), log_entry)
+            log_entries.append(log_entry)
 
-    udp_socket.close()
-    return total_sent
+    return log_entries
 
-# Main function to orchestrate the flow
-def process_organization(credentials):
-    api_key = credentials['API']
+class MerakiSource(Source):
+    """Meraki appliance security events; one API key gives access to several organizations."""
 
-    # Get all organizations for the given API key
-    organizations = get_all_organizations(api_key)
-    total_events_fetched = 0
-    total_events_sent = 0
+    tool = 'MER'
+    rate_limit = 8  # Meraki allows 10 requests per second per organization
 
-    # Iterate over all organizations
-    for organization_id, organization_name in organizations:
-        logging.info(f"Fetching events from {organization_name}...")
+    def __init__(self, credentials, organization_id=None, organization_name=None):
+        super().__init__(credentials)
+        self.organization_id = organization_id
+        if organization_name:
+            self.org = organization_name
 
-        events = fetch_security_events(api_key, organization_id)
-        total_events_fetched += sum(event_info["count"] for event_info in events.values())
+    async def auth(self, client):
+        self.headers = {'Authorization': f"Bearer {self.credentials['API']}"}
 
-        if events:
-            logging.info(f"Sending {len(events)} events from {organization_name} to Graylog...")
-            total_events_sent += send_to_graylog(events, organization_name)
-
-    return total_events_fetched, total_events_sent
+    # Get all organizations' IDs and names using the API key
+    async def discover(self, client):
+        response = await client.request('GET', ORGANIZATIONS_URL, headers=self.headers, keep_auth_on_redirect=True, rate=self.rate)
+        if not response.data:
+            logging.error("No organizations found.")
+            return []
+        tenants = []
+        for org in response.data:
+            tenant = MerakiSource(self.credentials, org["id"], org["name"])
+            tenant.headers = self.headers
+            tenants.append(tenant)
+        return tenants
+
+    async def paginate(self, client, start, end):
+        url = EVENTS_URL.format(organization_id=self.organization_id)
+        params = {
+            't0': start.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),  # Start time (UTC)
+            't1': end.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),  # End time (UTC)
+            'perPage': PAGE_SIZE,  # Number of events per page
+            'sortOrder': 'descending'  # Sort by the most recent events first
+        }
+
+        while url:
+            response = await client.request('GET', url, params=params, headers=self.headers, keep_auth_on_redirect=True, rate=self.rate)
+            if response.data:
+                yield self.org, response.data
+            else:
+                logging.info("No security events found.")
 
-# Main function to execute the script
-def main():
-    total_events_fetched = 0
-    total_events_sent = 0
+            # The next link already carries the query parameters
+            url = response.links.get('next', {}).get('url')
+            params = None
 
-    # Use ThreadPoolExecutor for concurrent execution
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_organization, credentials) for credentials in MER_CREDENTIALS]
+    def event_time(self, event):
+        return event.get('timestamp') or ''
 
-        for future in concurrent.futures.as_completed(futures):
-            fetched, sent = future.result()
-            total_events_fetched += fetched
-            total_events_sent += sent
+    def transform(self, org_name, records):
+        return build_log_entries(group_events(records), org_name, projection)
 
-    logging.info(f"Total events fetched: {total_events_fetched}")
-    logging.info(f"Total events sent: {total_events_sent}")
+# Main function to execute the script (see --backfill)
+def main():
+    run_collector('MER', [MerakiSource(credentials) for credentials in owned_credentials('MER', MER_CREDENTIALS)])
 
 # Run the script
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,5 @@
+MISP_CREDENTIALS = {
+    'URL': '',  # e.g. https://misp.example.org
+    'KEY': '',
+    'VERIFY_SSL': False,
+}
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import requests
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from MISP_API import MISP_CREDENTIALS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Event templates used by the Shuffle workflow, reused here as the base of the aggregated events
+CATEGORY_TEMPLATES = {
+    'phishing': os.path.join(BASE_DIR, 'MISP_Event_Phishing.txt'),
+    'malware': os.path.join(BASE_DIR, 'MISP_Event_Malware.txt'),
+}
+DEFAULT_TEMPLATE = 'malware'
+
+# Local index of the (type, value) pairs already published to MISP
+PUBLISHED_INDEX = os.path.join(BASE_DIR, 'misp_published.idx')
+
+# Accumulation window and Umbrella polling interval (the UMB query looks back 5 minutes)
+WINDOW_SECONDS = 3600
+POLL_SECONDS = 300
+
+
+class PublishedIndex:
+    """Append-only file of 'type<TAB>value' lines, loaded into a set for O(1) lookups."""
+
+    def __init__(self, path=PUBLISHED_INDEX):
+        self.path = path
+        self.entries = set()
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    attr_type, _, value = line.rstrip('\n').partition('\t')
+                    if value:
+                        self.entries.add((attr_type, value))
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_many(self, keys):
+        with self.lock:
+            new_keys = [key for key in keys if key not in self.entries]
+            if not new_keys:
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for attr_type, value in new_keys:
+                    f.write(f'{attr_type}\t{value}\n')
+            self.entries.update(new_keys)
+
+
+class MISPClient:
+    """Pooled MISP REST client, one keep-alive session shared by every submission."""
+
+    def __init__(self, url=None, key=None, verify=None, pool_size=10):
+        self.url = (url or MISP_CREDENTIALS['URL']).rstrip('/')
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': key if key is not None else MISP_CREDENTIALS['KEY'],
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        })
+        self.session.verify = MISP_CREDENTIALS['VERIFY_SSL'] if verify is None else verify
+        # POST /events/add is not idempotent: a 5xx or a read timeout may come after MISP stored the event,
+        # so only retry when the request never reached MISP (connect errors) or was throttled (429)
+        retries = Retry(total=3, connect=3, read=0, status=3, backoff_factor=1, status_forcelist=(429,),
+                        allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def add_event(self, event):
+        response = self.session.post(f'{self.url}/events/add', data=json.dumps(event), timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+# Function to load a MISP event template, dropping the Shuffle placeholders
+def load_template(name):
+    with open(CATEGORY_TEMPLATES[name], encoding='utf-8') as f:
+        template = json.load(f)
+    prototypes = {attribute['type']: attribute for attribute in template['Event'].pop('Attribute', [])}
+    return template, prototypes
+
+
+# Function to get the category label of a flattened Umbrella record
+def get_category(log):
+    category = log.get('policycategories_0')
+    if isinstance(category, dict):
+        return category.get('label') or 'Unknown'
+    return category or 'Unknown'
+
+
+# Function to pick the template for an Umbrella category label
+def template_for(category):
+    category = category.lower()
+    for name in CATEGORY_TEMPLATES:
+        if name in category:
+            return name
+    return DEFAULT_TEMPLATE
+
+
+# Function to resolve a domain to its IP address (same lookup as IP_From_Malware_Domain.py)
+def resolve_domain(domain):
+    try:
+        return socket.gethostbyname(domain)
+    except (socket.gaierror, UnicodeError):
+        return None
+
+
+class EventBuilder:
+    """Accumulates Umbrella detections and builds one MISP event per category."""
+
+    def __init__(self, index, resolve=True, max_workers=20):
+        self.index = index
+        self.resolve = resolve
+        self.max_workers = max_workers
+        self.detections = {}  # category -> {domain: first detection}
+
+    def add(self, logs):
+        added = 0
+        for log in logs:
+            domain = log.get('domain')
+            if not domain:
+                continue
+            domains = self.detections.setdefault(get_category(log), {})
+            if domain not in domains:
+                domains[domain] = log
+                added += 1
+        return added
+
+    def build(self):
+        resolved = {}
+        if self.resolve:
+            domains = {domain for domains in self.detections.values() for domain in domains
+                       if ('domain', domain) not in self.index}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                resolved = dict(zip(domains, executor.map(resolve_domain, domains)))
+
+        events = []
+        seen = set()  # shared by every category: a domain seen under two categories is only published once
+        for category, domains in sorted(self.detections.items()):
+            template, prototypes = load_template(template_for(category))
+            attributes = []
+            contributing = []  # detections that produced at least one attribute
+            for domain, log in domains.items():
+                candidates = [('domain', domain)]
+                if resolved.get(domain):
+                    candidates.append(('ip-src', resolved[domain]))
+                for attr_type, value in candidates:
+                    key = (attr_type, value)
+                    if key in self.index or key in seen or attr_type not in prototypes:
+                        continue
+                    seen.add(key)
+                    attribute = dict(prototypes[attr_type])
+                    attribute['value'] = value
+                    attribute['comment'] = f"{attribute.get('comment', '')} ({log.get('organization', '')})".strip()
+                    attributes.append(attribute)
+                    if not contributing or contributing[-1] is not log:
+                        contributing.append(log)
+            if not attributes:
+                logging.info(f"No new attributes for category {category}, skipping event.")
+                continue
+
+            dates = sorted(log['date'] for log in contributing if log.get('date'))
+            event = template['Event']
+            event['info'] = f"{event['info']} ({category}) - {len(contributing)} dominios"
+            event['date'] = dates[0] if dates else datetime.now().strftime('%Y-%m-%d')
+            event['Attribute'] = attributes
+            events.append(template)
+        return events
+
+    def clear(self):
+        self.detections = {}
+
+
+# Function to submit the built events and record the published attributes
+def publish(events, client, index, max_workers=4):
+    def submit(event):
+        try:
+            client.add_event(event)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error publishing MISP event '{event['Event']['info']}': {e}")
+            return 0
+        index.add_many((attribute['type'], attribute['value']) for attribute in event['Event']['Attribute'])
+        return len(event['Event']['Attribute'])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        published = list(executor.map(submit, events))
+    logging.info(f"Published {sum(1 for count in published if count)} events with {sum(published)} attributes to MISP")
+    return sum(published)
+
+
+# Function to poll Umbrella for the whole window
+def accumulate_from_umbrella(builder, window_seconds=WINDOW_SECONDS, poll_seconds=POLL_SECONDS):
+    from Collector_Core import fetch_sources
+    from UMB_to_SIEM import API_CREDENTIALS, UmbrellaSource
+
+    deadline = time.monotonic() + window_seconds
+    while True:
+        for org_name, logs in fetch_sources([UmbrellaSource(credentials) for credentials in API_CREDENTIALS]):
+            added = builder.add(logs)
+            logging.info(f"Accumulated {added} new detections from {org_name}")
+        if time.monotonic() + poll_seconds > deadline:
+            break
+        time.sleep(poll_seconds)
+
+
+# Function to read detections from a JSON array or JSON lines file (e.g. the html_to_json output)
+def read_detections(path):
+    with open(path, encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build aggregated MISP events from Umbrella detections.')
+    parser.add_argument('--input', help='JSON/JSON lines file with flattened Umbrella detections instead of polling Umbrella')
+    parser.add_argument('--window', type=int, default=WINDOW_SECONDS, help='Accumulation window in seconds')
+    parser.add_argument('--misp-url', help='Override the MISP URL (e.g. a local stand-in)')
+    parser.add_argument('--index', default=PUBLISHED_INDEX, help='Path of the already-published attribute index')
+    parser.add_argument('--no-resolve', action='store_true', help='Do not add the ip-src attribute of each domain')
+    parser.add_argument('--dry-run', action='store_true', help='Print the events instead of publishing them')
+    args = parser.parse_args()
+
+    index = PublishedIndex(args.index)
+    builder = EventBuilder(index, resolve=not args.no_resolve)
+    if args.input:
+        builder.add(read_detections(args.input))
+    else:
+        accumulate_from_umbrella(builder, args.window)
+
+    events = builder.build()
+    logging.info(f"Built {len(events)} aggregated events ({len(index)} attributes already published)")
+    if args.dry_run:
+        print(json.dumps(events, indent=2, ensure_ascii=False))
+        return
+
+    client = MISPClient(url=args.misp_url)
+    try:
+        publish(events, client, index)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import requests
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Webex bot and Outlook (Graph) tokens
+WEBEX_TOKEN = '<Bot_Token>'
+OUTLOOK_TOKEN = '<OAuth2_Access_Token>'
+
+# Digest thresholds: flush a digest when it holds this many alerts or is this old
+DIGEST_MAX_ALERTS = 20
+DIGEST_MAX_AGE = 60  # seconds
+
+# Longest wait honoured from a 429 Retry-After header
+MAX_RETRY_AFTER = 300  # seconds
+
+# Channel configuration. 'digest' maps each text field of the payload to how the rendered
+# alerts are merged: (separator between header and alert, split at the last separator, joiner)
+CHANNELS = {
+    'webex': {
+        'template': os.path.join(BASE_DIR, 'WEBEX_Notification.txt'),
+        'url': 'https://webexapis.com/v1/messages',
+        'token': WEBEX_TOKEN,
+        'rate': 1.0,  # messages per second
+        'burst': 5,
+        'workers': 4,
+        'digest': {
+            'text': ('\n', False, '\n'),
+            'markdown': ('\n\n', False, '\n\n'),
+        },
+    },
+    'outlook': {
+        'template': os.path.join(BASE_DIR, 'OUTLOOK_Message_Body.txt'),
+        'url': 'https://graph.microsoft.com/v1.0/me/sendMail',
+        'token': OUTLOOK_TOKEN,
+        'rate': 0.5,
+        'burst': 2,
+        'workers': 2,
+        'digest': {
+            'body.content': ('<br><br>', True, ''),
+        },
+        'count_field': 'subject',
+        'envelope': 'message',  # Graph expects {"message": <payload>}
+    },
+}
+
+PLACEHOLDER = re.compile(r'\$([A-Za-z_]+)\.#\.([A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*)')
+
+
+class CompiledString(tuple):
+    """Template string split into literal parts and (source, path) placeholders."""
+
+
+# Function to compile a string with Shuffle placeholders into literal and lookup parts
+def compile_string(value):
+    parts = []
+    position = 0
+    for match in PLACEHOLDER.finditer(value):
+        if match.start() > position:
+            parts.append(value[position:match.start()])
+        parts.append((match.group(1), match.group(2)))
+        position = match.end()
+    if position < len(value):
+        parts.append(value[position:])
+    return CompiledString(parts)
+
+
+def compile_node(node):
+    if isinstance(node, dict):
+        return {key: compile_node(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [compile_node(item) for item in node]
+    if isinstance(node, str):
+        return compile_string(node)
+    return node
+
+
+# Function to compile a JSON template, cached per file and modification time
+@lru_cache(maxsize=32)
+def compile_template(path, mtime):
+    with open(path, encoding='utf-8') as f:
+        return compile_node(json.load(f))
+
+
+def get_template(path):
+    return compile_template(path, os.path.getmtime(path))
+
+
+# Function to look up a dotted path, accepting flattened keys such as 'identities_0.label'
+def lookup(data, path):
+    if not isinstance(data, dict):
+        return ''
+    if path in data:
+        return '' if data[path] is None else data[path]
+    head, _, rest = path.partition('.')
+    if not rest or head not in data:
+        return ''
+    return lookup(data[head], rest)
+
+
+def render_node(node, sources):
+    if isinstance(node, CompiledString):
+        return ''.join(part if isinstance(part, str) else str(lookup(sources.get(part[0]), part[1])) for part in node)
+    if isinstance(node, dict):
+        return {key: render_node(value, sources) for key, value in node.items()}
+    if isinstance(node, list):
+        return [render_node(item, sources) for item in node]
+    return node
+
+
+# Same transformation as Defang_Domain.py
+def defang_domain(url):
+    return url.replace('.', '[.]').replace('://', '[://]').replace('www.', '[www.]')
+
+
+# Function to render a compiled template for one alert
+def render_alert(compiled, alert):
+    sources = {
+        'html_to_json': alert,
+        'defang_domain': {'message': defang_domain(alert.get('domain', ''))},
+        'jira_issue': {'body': {'key': alert.get('jira_key', '')}},
+    }
+    return render_node(compiled, sources)
+
+
+def get_field(payload, path):
+    for key in path.split('.'):
+        payload = payload[key]
+    return payload
+
+
+def set_field(payload, path, value):
+    *parents, last = path.split('.')
+    for key in parents:
+        payload = payload[key]
+    payload[last] = value
+
+
+# Function to merge the rendered alerts of one (organization, tool) into a single payload
+def build_digest(channel, alerts):
+    compiled = get_template(channel['template'])
+    rendered = [render_alert(compiled, alert) for alert in alerts]
+    payload = rendered[0]
+    if len(rendered) > 1:
+        for path, (separator, from_right, joiner) in channel['digest'].items():
+            split = str.rpartition if from_right else str.partition
+            header, _, _ = split(get_field(payload, path), separator)
+            items = [split(get_field(message, path), separator)[2] for message in rendered]
+            set_field(payload, path, header + separator + joiner.join(items))
+        if channel.get('count_field'):
+            set_field(payload, channel['count_field'], f"{get_field(payload, channel['count_field'])} ({len(alerts)} alertas)")
+    if channel.get('envelope'):
+        payload = {channel['envelope']: payload}
+    return payload
+
+
+# Function to read a Retry-After header: delay in seconds or HTTP date, 1 second when missing or invalid
+def parse_retry_after(value):
+    if not value:
+        return 1.0
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return 1.0
+    return min(max(delay, 0.0), MAX_RETRY_AFTER)
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to respect the per-channel rate limit."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Channel:
+    """Outgoing queue of one notification channel, drained by pooled worker threads."""
+
+    def __init__(self, name, config, dispatcher, dry_run=False):
+        self.name = name
+        self.config = config
+        self.dispatcher = dispatcher
+        self.dry_run = dry_run
+        self.queue = queue.Queue()
+        self.bucket = TokenBucket(config['rate'], config['burst'])
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f"Bearer {config['token']}",
+            'Content-Type': 'application/json',
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['workers'])
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(config['workers'])]
+        for worker in self.workers:
+            worker.start()
+
+    def work(self):
+        while True:
+            payload = self.queue.get()
+            if payload is None:
+                self.queue.task_done()
+                return
+            try:
+                self.send(payload)
+            except Exception as e:
+                # A worker must survive any error, otherwise close() waits forever on the queue
+                logging.error(f"Unexpected error sending {self.name} notification: {e}")
+                self.dispatcher.count('failed')
+            finally:
+                self.queue.task_done()
+
+    def send(self, payload, attempts=3):
+        for attempt in range(attempts):
+            self.bucket.acquire()
+            if self.dry_run:
+                with self.dispatcher.lock:
+                    print(json.dumps({'channel': self.name, 'payload': payload}, ensure_ascii=False), flush=True)
+                self.dispatcher.count('sent')
+                return
+            try:
+                response = self.session.post(self.config['url'], data=json.dumps(payload), timeout=30)
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Error sending {self.name} notification: {e}")
+                continue
+            if response.status_code == 429:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                logging.warning(f"{self.name} throttled, retrying in {retry_after}s")
+                time.sleep(retry_after)
+                continue
+            if response.status_code < 300:
+                self.dispatcher.count('sent')
+                return
+            logging.error(f"Failed to send {self.name} notification: {response.status_code} - {response.text}")
+            break
+        self.dispatcher.count('failed')
+
+    def close(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.session.close()
+
+
+class NotificationDispatcher:
+    """Coalesces alerts per (organization, tool) into digests and fans them out to every channel."""
+
+    def __init__(self, channels=None, max_alerts=DIGEST_MAX_ALERTS, max_age=DIGEST_MAX_AGE, dry_run=False):
+        self.max_alerts = max_alerts
+        self.max_age = max_age
+        self.digests = {}  # (organization, tool) -> (first alert time, alerts)
+        self.lock = threading.Lock()
+        self.stats = {'alerts': 0, 'coalesced': 0, 'digests': 0, 'queued': 0, 'sent': 0, 'failed': 0}
+        self.channels = [Channel(name, CHANNELS[name], self, dry_run) for name in (channels or CHANNELS)]
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_expired, daemon=True)
+        self.flusher.start()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def submit(self, alert):
+        key = (alert.get('organization', ''), alert.get('tool', ''))
+        with self.lock:
+            self.stats['alerts'] += 1
+            if key in self.digests:
+                self.stats['coalesced'] += 1
+                self.digests[key][1].append(alert)
+            else:
+                self.digests[key] = (time.monotonic(), [alert])
+            full = len(self.digests[key][1]) >= self.max_alerts
+            alerts = self.digests.pop(key)[1] if full else None
+        if alerts:
+            self.enqueue(alerts)
+
+    def enqueue(self, alerts):
+        for channel in self.channels:
+            channel.queue.put(build_digest(channel.config, alerts))
+            self.count('queued')
+        self.count('digests')
+
+    def flush(self, max_age=None):
+        now = time.monotonic()
+        with self.lock:
+            keys = [key for key, (started, _) in self.digests.items() if max_age is None or now - started >= max_age]
+            ready = [self.digests.pop(key)[1] for key in keys]
+        for alerts in ready:
+            self.enqueue(alerts)
+
+    def flush_expired(self):
+        while not self.stopped.wait(1):
+            self.flush(self.max_age)
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+        for channel in self.channels:
+            channel.queue.join()
+            channel.close()
+        logging.info(f"Notifications: {self.stats}")
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send Webex/Outlook digests for alerts read as JSON lines.')
+    parser.add_argument('--input', help='JSON lines file with alerts (defaults to stdin)')
+    parser.add_argument('--channels', nargs='+', choices=list(CHANNELS), help='Channels to notify (default: all)')
+    parser.add_argument('--max-alerts', type=int, default=DIGEST_MAX_ALERTS, help='Flush a digest at this many alerts')
+    parser.add_argument('--max-age', type=float, default=DIGEST_MAX_AGE, help='Flush a digest after this many seconds')
+    parser.add_argument('--dry-run', action='store_true', help='Print the payloads instead of sending them')
+    args = parser.parse_args()
+
+    dispatcher = NotificationDispatcher(args.channels, args.max_alerts, args.max_age, args.dry_run)
+    stream = open(args.input, encoding='utf-8') if args.input else sys.stdin
+    try:
+        for line in stream:
+            if line.strip():
+                dispatcher.submit(json.loads(line))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        dispatcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import bisect
+import hashlib
+import logging
+import argparse
+import subprocess
+
+# Sharding is configured through the environment so every collector picks it up unchanged:
+#   SOC_WORKERS     comma separated list of all worker ids (e.g. "host1-0,host1-1,host2-0")
+#   SOC_WORKER_ID   id of this worker, one of SOC_WORKERS
+#   SOC_LEASE_FILE  optional lease file shared by all workers (local disk or NFS mount)
+WORKERS_ENV = 'SOC_WORKERS'
+WORKER_ID_ENV = 'SOC_WORKER_ID'
+LEASE_FILE_ENV = 'SOC_LEASE_FILE'
+
+VIRTUAL_NODES = 128
+LEASE_TTL = 300  # seconds, one collection interval
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def tenant_key(tool, org):
+    return f'{tool}:{org}'
+
+
+class HashRing:
+    """Consistent-hash ring: adding or removing a worker only moves the tenants of that worker."""
+
+    def __init__(self, workers, vnodes=VIRTUAL_NODES):
+        self.workers = sorted(set(workers))
+        ring = sorted((hash_key(f'{worker}#{i}'), worker) for worker in self.workers for i in range(vnodes))
+        self.points = [point for point, _ in ring]
+        self.owners = [worker for _, worker in ring]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        idx = bisect.bisect(self.points, hash_key(key)) % len(self.points)
+        return self.owners[idx]
+
+
+class LeaseFile:
+    """JSON lease table guarded by an exclusive flock, so no tenant is held by two workers at once."""
+
+    def __init__(self, path, ttl=LEASE_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def acquire(self, worker, keys):
+        acquired = []
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                leases = json.loads(content) if content.strip() else {}
+                now = time.time()
+                for key in keys:
+                    lease = leases.get(key)
+                    if lease and lease['worker'] != worker and lease['expires'] > now:
+                        logging.warning(f"Tenant {key} is leased by {lease['worker']}, skipping")
+                        continue
+                    leases[key] = {'worker': worker, 'expires': now + self.ttl}
+                    acquired.append(key)
+                leases = {key: lease for key, lease in leases.items() if lease['expires'] > now}
+                f.seek(0)
+                f.truncate()
+                json.dump(leases, f)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return acquired
+
+
+# Function to get the sharding configuration from the environment (None when sharding is off)
+def get_shard_config():
+    workers = [worker.strip() for worker in os.environ.get(WORKERS_ENV, '').split(',') if worker.strip()]
+    worker_id = os.environ.get(WORKER_ID_ENV)
+    if not workers or not worker_id:
+        return None
+    if worker_id not in workers:
+        raise ValueError(f"{WORKER_ID_ENV}={worker_id} is not listed in {WORKERS_ENV}")
+    return worker_id, workers, os.environ.get(LEASE_FILE_ENV)
+
+
+# Function to get one tenant key per credentials entry; entries sharing an org name get their
+# position appended ('UMB:Acme#2') so no tenant is dropped or held by two workers
+def credential_keys(tool, credentials, org_key='ORG'):
+    keys = []
+    seen = {}
+    for creds in credentials:
+        key = tenant_key(tool, creds[org_key])
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] > 1:
+            logging.warning(f"Duplicate {tool} organization name {creds[org_key]!r}, sharding it as entry #{seen[key]}")
+            key = f'{key}#{seen[key]}'
+        keys.append(key)
+    return keys
+
+
+# Function to keep only the tenants of a credentials list owned by this worker
+def owned_credentials(tool, credentials, org_key='ORG'):
+    config = get_shard_config()
+    if config is None:
+        return list(credentials)
+    worker_id, workers, lease_path = config
+
+    ring = HashRing(workers)
+    owned = {key: creds for key, creds in zip(credential_keys(tool, credentials, org_key), credentials)
+             if ring.owner(key) == worker_id}
+    if lease_path:
+        keys = LeaseFile(lease_path).acquire(worker_id, list(owned))
+        owned = {key: owned[key] for key in keys}
+
+    logging.info(f"Worker {worker_id}: collecting {len(owned)}/{len(credentials)} {tool} tenants")
+    return list(owned.values())
+
+
+# Function to list every (tool, org) tenant configured in the credential modules
+def all_tenants():
+    from DUO_API import ORG_CREDENTIALS
+    from EDR_API import EDR_CREDENTIALS
+    from MER_API import MER_CREDENTIALS
+    from UMB_API import API_CREDENTIALS
+
+    sources = [('DUO', ORG_CREDENTIALS), ('EDR', EDR_CREDENTIALS), ('MER', MER_CREDENTIALS), ('UMB', API_CREDENTIALS)]
+    return [key for tool, credentials in sources for key in credential_keys(tool, credentials)]
+
+
+# Function to print the tenant assignment for a list of workers
+def show_plan(workers):
+    ring = HashRing(workers)
+    plan = {}
+    for key in all_tenants():
+        plan.setdefault(ring.owner(key), []).append(key)
+    for worker in ring.workers:
+        print(f"{worker}: {len(plan.get(worker, []))} tenants")
+        for key in plan.get(worker, []):
+            print(f"  {key}")
+
+
+# Function to run a collector as N local worker processes, one shard each
+def run_local(script, processes, args, lease_file=None):
+    workers = [f'{os.uname().nodename}-{i}' for i in range(processes)]
+    children = []
+    for worker in workers:
+        env = dict(os.environ, **{WORKERS_ENV: ','.join(workers), WORKER_ID_ENV: worker})
+        if lease_file:
+            env[LEASE_FILE_ENV] = lease_file
+        children.append(subprocess.Popen([sys.executable, script, *args], env=env))
+    return max(child.wait() for child in children)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Run a collector sharded across local worker processes.')
+    parser.add_argument('script', nargs='?', help='Collector script to run (e.g. UMB_to_SIEM.py)')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments passed to the collector')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Number of local worker processes')
+    parser.add_argument('--lease-file', help='Shared lease file used to guard against double collection')
+    parser.add_argument('--plan', help='Comma separated worker ids: print the tenant assignment and exit')
+    args = parser.parse_args()
+
+    if args.plan:
+        show_plan([worker.strip() for worker in args.plan.split(',') if worker.strip()])
+        return
+    if not args.script:
+        parser.error('a collector script is required')
+    sys.exit(run_local(args.script, args.processes, args.args, args.lease_file))
+
+
+if __name__ == '__main__':
+    main()
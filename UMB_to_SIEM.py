@@ -1,114 +1,80 @@
-import json
-import requests
-import socket
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from time import sleep
 from UMB_API import API_CREDENTIALS
-
-# Graylog UDP host and port
-GRAYLOG_HOST = '127.0.0.1'
-GRAYLOG_PORT = 12201
+from Tenant_Sharding import owned_credentials
+from Collector_Core import Source, run_collector, to_millis
+from Field_Projection import STATS, get_projection
 
 # Configure logging for better error tracking
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Function to send logs to Graylog using UDP
-def send_to_graylog(logs):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            for log in logs:
-                msg = json.dumps(log)
-                sock.sendto(msg.encode(), (GRAYLOG_HOST, GRAYLOG_PORT))
-    except Exception as e:
-        logging.error(f"Error sending logs to Graylog: {e}")
-
-# Function to fetch and process logs for each organization
-def fetch_and_process_logs(api_key, secret_key, org_name):
-    # Step 1: Get the access token
-    auth_url = 'https://api.umbrella.com/auth/v2/token'
-    auth_data = {'grant_type': 'client_credentials'}
-    auth_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    try:
-        auth_response = requests.post(auth_url, auth_data, auth_headers, auth=(api_key, secret_key), timeout=10)
-        auth_response.raise_for_status()
-        access_token = auth_response.json().get('access_token')
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching access token for {org_name}: {e}")
-        return []
-
-    # Step 2: Fetch DNS activity logs
-    logs_url = 'https://api.umbrella.com/reports/v2/activity?from=-5minutes&to=now&limit=4999&verdict=blocked&policycategories=65,64,150,110,61,66,67,108,68,109&timezone=EUROPE%2fMADRID'
-    logs_headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
-    try:
-        logs_response = requests.get(logs_url, headers=logs_headers, timeout=10)
-        logs_response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching logs for {org_name}: {e}")
-        return []
+AUTH_URL = 'https://api.umbrella.com/auth/v2/token'
+LOGS_URL = 'https://api.umbrella.com/reports/v2/activity'
 
-    logs_data = logs_response.json().get('data', [])
-    
-    # Step 3: Flatten logs and add labels
-    flattened_logs = []
-    for log in logs_data:
-        flattened_log = flatten_log(log)
-        flattened_log['organization'] = org_name
-        flattened_log['tool'] = 'UMB'
-        flattened_logs.append(flattened_log)
+# Blocked DNS activity in the security categories we report on
+LOGS_PARAMS = {
+    'verdict': 'blocked',
+    'policycategories': '65,64,150,110,61,66,67,108,68,109',
+    'timezone': 'EUROPE/MADRID',
+}
+PAGE_SIZE = 4999
 
-    return flattened_logs
+# Fields sent to Graylog (see Field_Projection.py)
+projection = get_projection('UMB')
 
-# Helper function to flatten nested log structure
-def flatten_log(log):
+# Helper function to flatten nested log structure, skipping the fields the projection drops
+def flatten_log(log, projection=None):
     flattened = {}
+    emit = projection.emit if projection else dict.__setitem__
     for key, value in log.items():
         if isinstance(value, dict):
             for sub_key, sub_value in value.items():
-                flattened[f'{key}_{sub_key}'] = sub_value
+                emit(flattened, f'{key}_{sub_key}', sub_value)
         elif isinstance(value, list):
             for idx, item in enumerate(value):
-                flattened[f'{key}_{idx}'] = item
+                emit(flattened, f'{key}_{idx}', item)
         else:
-            flattened[key] = value
+            emit(flattened, key, value)
     return flattened
 
-# Function to handle the entire process for each organization
-def process_organization(credentials):
-    api_key = credentials['API']
-    secret_key = credentials['KEY']
-    org_name = credentials['ORG']
-
-    logging.info(f"Fetching events from {org_name}...")
-    logs = fetch_and_process_logs(api_key, secret_key, org_name)
-
-    return org_name, logs
-
-# Main execution with parallelization
+class UmbrellaSource(Source):
+    """Umbrella DNS activity of one organization."""
+
+    tool = 'UMB'
+    rate_limit = 5  # requests per second
+
+    async def auth(self, client):
+        # Step 1: Get the access token
+        response = await client.request('POST', AUTH_URL, data={'grant_type': 'client_credentials'},
+                                        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                        auth=(self.credentials['API'], self.credentials['KEY']), rate=self.rate)
+        self.headers = {'Authorization': f"Bearer {response.data.get('access_token')}", 'Content-Type': 'application/json'}
+
+    async def paginate(self, client, start, end):
+        # Step 2: Fetch DNS activity logs, one page of PAGE_SIZE records at a time
+        params = dict(LOGS_PARAMS, **{'from': to_millis(start), 'to': to_millis(end), 'limit': PAGE_SIZE, 'offset': 0})
+        while True:
+            response = await client.request('GET', LOGS_URL, params=params, headers=self.headers, rate=self.rate)
+            logs_data = response.data.get('data', [])
+            yield self.org, logs_data
+            if len(logs_data) < PAGE_SIZE:
+                break
+            params['offset'] += PAGE_SIZE
+
+    def transform(self, org_name, records):
+        # Step 3: Flatten logs and add labels
+        flattened_logs = []
+        for log in records:
+            flattened_log = flatten_log(log, projection)
+            if projection and STATS.sample(self.tool):
+                STATS.record(self.tool, flatten_log(log), flattened_log)
+            flattened_log['organization'] = org_name
+            flattened_log['tool'] = self.tool
+            flattened_logs.append(flattened_log)
+        return flattened_logs
+
+# Main execution: every organization is fetched concurrently by the collector core (see --backfill)
 def main():
-    total_fetched_events = 0
-    total_sent_events = 0
-    
-    # Use ThreadPoolExecutor to fetch logs concurrently
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        future_to_org = {executor.submit(process_organization, credentials): credentials for credentials in API_CREDENTIALS}
-
-        # Process results as they complete
-        for future in as_completed(future_to_org):
-            try:
-                org_name, logs = future.result()
-                total_fetched_events += len(logs)
-
-                if logs:
-                    logging.info(f"Sending {len(logs)} events from {org_name} to Graylog...")
-                    send_to_graylog(logs)
-                    total_sent_events += len(logs)
-            except Exception as e:
-                logging.error(f"Error processing organization: {e}")
-                sleep(5)  # Sleep for 5 seconds before retrying or continuing
-
-    logging.info(f"Total events fetched: {total_fetched_events}")
-    logging.info(f"Total events sent: {total_sent_events}")
+    run_collector('UMB', [UmbrellaSource(credentials) for credentials in owned_credentials('UMB', API_CREDENTIALS)])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
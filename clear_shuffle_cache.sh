@@ -1,18 +1,8 @@
 #!/bin/bash
 
-# OpenSearch creds & endpoint
-OS_HOST="https://localhost:9200"
-OS_USER="myuser"
-OS_PASS="yourpassword"
+# Throttled purge of the Shuffle executions older than the retention.
+# The OpenSearch endpoint, credentials, index and retention are set in Clear_Shuffle_Cache.py;
+# extra arguments are passed through (e.g. --retention-days 3 or --rollover).
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 
-# Index to clear
-INDEX="workflowexecution"
-
-# Delete all documents from index
-curl -X POST "$OS_HOST/$INDEX/_delete_by_query?conflicts=proceed" \
-  -u "$OS_USER:$OS_PASS" -H 'Content-Type: application/json' \
-  -d '{
-    "query": { "match_all": {} }
-  }' -k
-
-echo "$(date): Cleared $INDEX" >> /var/log/clear_index.log
+python3 "$SCRIPT_DIR/Clear_Shuffle_Cache.py" "$@"